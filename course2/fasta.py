@@ -0,0 +1,209 @@
+"""Streaming and indexed FASTA readers.
+
+`read_fasta` from the profiling notebook builds each sequence with
+`curseq += l.strip()` and keeps the whole file in a dictionary. The
+functions below read the file in linear time, and `IndexedFasta` only
+keeps a `.fai` index in memory: sequences are read from a memory-mapped
+file when they are accessed.
+"""
+
+import mmap
+import os
+
+
+def iter_fasta(filename):
+    """Reads a FASTA file one record at a time.
+
+    Yields (name, sequence) tuples, where name is the header line without
+    the leading ">" and sequence is a `bytes` object. The lines of a
+    sequence are accumulated in a bytearray, so reading time is linear and
+    only one record is held in memory at a time.
+    """
+    name = None
+    seq = bytearray()
+    with open(filename, "rb") as IN:
+        for l in IN:
+            if l.startswith(b">"):
+                if name is not None:
+                    yield name, bytes(seq)
+                name = l[1:].strip().decode()
+                seq = bytearray()
+            else:
+                seq += l.strip()
+
+    if name is not None:
+        yield name, bytes(seq)
+
+
+def read_fasta(filename):
+    """Reads a FASTA file and returns its sequences as a dictionary.
+
+    Drop-in replacement for the `read_fasta` of the profiling notebook,
+    where the lines of each sequence are joined once instead of being
+    concatenated one by one.
+    """
+    Dseq = {}
+    cur = None
+    lines = []
+    with open(filename, "r") as IN:
+        for l in IN:
+            if l.startswith(">"):
+                if cur is not None:
+                    Dseq[cur] = "".join(lines)
+                cur = l[1:].strip()
+                lines = []
+            else:
+                lines.append(l.strip())
+
+    if cur is not None:
+        Dseq[cur] = "".join(lines)
+
+    return Dseq
+
+
+def build_fasta_index(filename):
+    """Computes the index of a FASTA file, in the format of `samtools faidx`.
+
+    Returns a list of (name, length, offset, line_bases, line_width) tuples:
+        name: the first word of the header line, without the leading ">"
+              (as samtools does, so that `samtools faidx` regions such as
+              "name:1-100" work; the rest of the header is a description).
+        length: number of bases of the sequence.
+        offset: position (in bytes) of the first base in the file.
+        line_bases: number of bases per line.
+        line_width: number of bytes per line, including the end of line.
+
+    All lines of a sequence but the last one must have the same length,
+    otherwise the position of a base cannot be computed and a ValueError
+    is raised.
+    """
+    index = []
+    record = None
+    last_line_short = False
+    position = 0
+
+    with open(filename, "rb") as IN:
+        for l in IN:
+            if l.startswith(b">"):
+                if record is not None:
+                    index.append(tuple(record))
+                words = l[1:].split(maxsplit=1)
+                name = words[0].decode() if words else ""
+                record = [name, 0, position + len(l), 0, 0]
+                last_line_short = False
+            elif record is not None:
+                bases = len(l.rstrip(b"\r\n"))
+                if record[3] == 0:
+                    record[3] = bases
+                    record[4] = len(l)
+                elif last_line_short or bases > record[3]:
+                    raise ValueError(
+                        "sequence {} has lines of different lengths".format(record[0])
+                    )
+                last_line_short = bases < record[3]
+                record[1] += bases
+            position += len(l)
+
+    if record is not None:
+        index.append(tuple(record))
+    return index
+
+
+def write_fasta_index(index, index_filename):
+    """Writes an index computed by `build_fasta_index` as a tab-separated
+    `.fai` file.
+    """
+    with open(index_filename, "w") as OUT:
+        for entry in index:
+            print(*entry, sep="\t", file=OUT)
+
+
+def read_fasta_index(index_filename):
+    """Reads a `.fai` file written by `write_fasta_index` (or samtools)."""
+    index = []
+    with open(index_filename, "r") as IN:
+        for l in IN:
+            name, *numbers = l.rstrip("\n").split("\t")
+            index.append((name, *(int(x) for x in numbers[:4])))
+    return index
+
+
+class IndexedFasta:
+    """Read-only, dictionary-like access to the sequences of a FASTA file.
+
+    The `.fai` index is built the first time the file is opened (and
+    written next to it), then reused as long as it is more recent than the
+    FASTA file. As with samtools, sequences are named by the first word of
+    their header line (unlike `iter_fasta`, which keeps the whole line),
+    and these names must be unique. Only the index is kept in memory: the
+    file is memory-mapped and a sequence is read from it when it is
+    accessed.
+
+    Example:
+        with IndexedFasta("data/large_file.fas") as fasta:
+            print(len(fasta), "sequences")
+            seq = fasta["seq42"]           # bytes
+            for name, seq in fasta.items():
+                ...
+    """
+
+    def __init__(self, filename, index_filename=None):
+        self.filename = filename
+        self.index_filename = index_filename or filename + ".fai"
+
+        if os.path.exists(self.index_filename) and os.path.getmtime(
+            self.index_filename
+        ) >= os.path.getmtime(filename):
+            index = read_fasta_index(self.index_filename)
+        else:
+            index = build_fasta_index(filename)
+            write_fasta_index(index, self.index_filename)
+        self.index = {}
+        for entry in index:
+            if entry[0] in self.index:
+                raise ValueError(
+                    "duplicate sequence name in {}: {}".format(filename, entry[0])
+                )
+            self.index[entry[0]] = entry[1:]
+
+        self._file = open(filename, "rb")
+        if os.path.getsize(filename) > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = b""
+
+    def __getitem__(self, name):
+        length, offset, line_bases, line_width = self.index[name]
+        if length == 0:
+            return b""
+        full_lines, rest = divmod(length, line_bases)
+        end = offset + full_lines * line_width + rest
+        return self._map[offset:end].translate(None, b"\r\n")
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def items(self):
+        """Yields (name, sequence) tuples, reading one sequence at a time."""
+        for name in self.index:
+            yield name, self[name]
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
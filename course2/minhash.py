@@ -0,0 +1,263 @@
+"""Approximate detection of near-duplicate sequences with MinHash and
+locality-sensitive hashing (LSH).
+
+Even fast exact implementations of `sequence_similarity_mat` are quadratic
+in the number of sequences. Here:
+
+1. each sequence is summarized by a MinHash sketch of its set of k-mers:
+   for each of <num_perm> hash functions, the minimum hash of its k-mers.
+   Two sketches agree on a hash function with a probability equal to the
+   Jaccard index of the two k-mer sets.
+2. the sketches are cut in <bands> bands, and sequences whose sketches are
+   identical on at least one band become candidate pairs (LSH). Each band
+   is processed by sorting the sketches, so this is sub-quadratic unless
+   most sequences are near-duplicates.
+3. the candidate pairs are verified with the exact similarity of
+   `compute_sequence_similarity` (fraction of identical positions).
+"""
+
+import numpy as np
+
+from sequence_composition import chunk_kmers, concatenate_sequences, record_chunks
+from sequence_similarity import encode_sequences, sequence_similarity_mat_onehot
+
+# Number of bases (and of k-mers) sketched at once: the hashes of the k-mers
+# are held in a (num_perm x MINHASH_CHUNK_BYTES) uint64 array at most, even
+# for a record longer than that.
+MINHASH_CHUNK_BYTES = 2**15
+
+EMPTY_HASH = np.uint32(2**32 - 1)
+# Multiplier used to combine the hashes of a band into a single key (keys
+# colliding by chance only add candidate pairs, removed by verification).
+KEY_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def hash_parameters(num_perm, seed=0):
+    """Draws the (a, b) parameters of <num_perm> hash functions
+    h(x) = ((a * x + b) mod 2**64) >> 32, with a odd (multiply-shift
+    hashing).
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2**63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(lseq, k=16, num_perm=128, seed=0):
+    """Computes the MinHash sketches of the k-mer sets of the sequences of
+    <lseq>. k-mers containing another character than A, C, G or T are
+    ignored (see `sequence_composition.count_kmers`), so k must be at most
+    32.
+
+    Returns a (number of sequences x <num_perm>) uint32 array. The sketch of
+    a sequence without any valid k-mer is filled with EMPTY_HASH.
+    """
+    a, b = hash_parameters(num_perm, seed)
+    buffer, offsets = concatenate_sequences(lseq)
+    signatures = np.full((len(lseq), num_perm), EMPTY_HASH, dtype=np.uint32)
+
+    for first, last in record_chunks(offsets, MINHASH_CHUNK_BYTES):
+        records, kmers = chunk_kmers(buffer, offsets, first, last, k)
+        # a long record is sketched by windows of its k-mers, each window
+        # updating the minima of the previous ones.
+        for start in range(0, len(kmers), MINHASH_CHUNK_BYTES):
+            window = slice(start, start + MINHASH_CHUNK_BYTES)
+            window_kmers, window_records = kmers[window], records[window]
+            hashes = a[:, np.newaxis] * window_kmers + b[:, np.newaxis]
+            hashes >>= np.uint64(32)
+            # records are sorted: minimum over the k-mers of each sequence.
+            starts = np.flatnonzero(np.diff(window_records, prepend=-1))
+            rows = first + window_records[starts]
+            signatures[rows] = np.minimum(
+                signatures[rows], np.minimum.reduceat(hashes, starts, axis=1).T
+            )
+    return signatures
+
+
+def band_threshold(num_perm, bands):
+    """Approximate Jaccard index above which a pair is likely to become a
+    candidate, with <bands> bands of num_perm / bands rows: (1/b)^(1/r).
+    """
+    return (1 / bands) ** (bands / num_perm)
+
+
+def choose_bands(num_perm, jaccard):
+    """Number of bands (a divisor of <num_perm>) whose `band_threshold` is
+    just below <jaccard>, to favour recall.
+
+    >>> choose_bands(128, 0.5)
+    32
+    """
+    divisors = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [b for b in divisors if band_threshold(num_perm, b) <= jaccard]
+    return min(below) if below else num_perm
+
+
+def expected_jaccard(similarity, k):
+    """Expected Jaccard index of the k-mer sets of two sequences with a
+    given <similarity>, if their differences are independent substitutions:
+    a k-mer is shared with probability similarity**k.
+    """
+    shared = similarity**k
+    return shared / (2 - shared)
+
+
+def lsh_candidate_pairs(signatures, bands):
+    """Pairs (i < j) of sketches identical on at least one of <bands> bands.
+
+    Returns (rows, cols) arrays of unique pairs. Sequences without any
+    valid k-mer are never candidates.
+    """
+    n, num_perm = signatures.shape
+    rows_per_band = num_perm // bands
+    sketched = np.flatnonzero(signatures[:, 0] != EMPTY_HASH)
+
+    pairs = []
+    for band in range(bands):
+        # key of the band: hash of its rows_per_band values.
+        keys = np.zeros(len(sketched), dtype=np.uint64)
+        for column in range(band * rows_per_band, (band + 1) * rows_per_band):
+            keys = keys * KEY_MULTIPLIER + signatures[sketched, column]
+
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        members = sketched[order]
+        # sequences with the same key are consecutive: pair the sequences
+        # 1, 2, ... positions apart, as long as some have the same key.
+        distance = 1
+        while distance < len(keys):
+            same = keys[distance:] == keys[:-distance]
+            if not same.any():
+                break
+            i, j = members[:-distance][same], members[distance:][same]
+            pairs.append(np.minimum(i, j) * n + np.maximum(i, j))
+            distance += 1
+
+    if not pairs:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+    pairs = np.unique(np.concatenate(pairs))
+    return pairs // n, pairs % n
+
+
+def verify_pairs(lseq, rows, cols, threshold):
+    """Exact similarity of the pairs (rows[p], cols[p]), with the same
+    definition as `compute_sequence_similarity`. Pairs of sequences with
+    different lengths are discarded.
+
+    Returns the (rows, cols, similarities) of the pairs with a similarity
+    of at least <threshold>.
+    """
+    lseq = list(lseq)
+    lengths = np.array([len(s) for s in lseq])
+    keep = lengths[rows] == lengths[cols]
+    rows, cols = rows[keep], cols[keep]
+
+    similarities = np.zeros(len(rows))
+    for length in np.unique(lengths[rows]):
+        # the sequences of a given length are compared as a uint8 array.
+        pairs = np.flatnonzero(lengths[rows] == length)
+        members = np.flatnonzero(lengths == length)
+        position = np.zeros(len(lseq), dtype=np.intp)
+        position[members] = np.arange(len(members))
+        seqs = encode_sequences([lseq[m] for m in members])
+        for start in range(0, len(pairs), 4096):
+            block = pairs[start : start + 4096]
+            same = seqs[position[rows[block]]] == seqs[position[cols[block]]]
+            similarities[block] = same.mean(axis=1)
+
+    found = similarities >= threshold - 1e-12
+    return rows[found], cols[found], similarities[found]
+
+
+def near_duplicate_pairs(
+    lseq, threshold, k=16, num_perm=128, bands=None, seed=0, stats=None
+):
+    """Finds the pairs of sequences of <lseq> with a similarity of at least
+    <threshold>, without comparing all pairs: candidate pairs are generated
+    by MinHash + LSH, then verified exactly (see the module docstring).
+
+    This is approximate: some pairs above the threshold may be missed (see
+    `minhash_recall`), but all the pairs returned are above it.
+
+    <k>: length of the k-mers.
+    <num_perm>: number of hash functions of the sketches.
+    <bands>: number of LSH bands. By default, it is chosen from the
+             Jaccard index expected at <threshold> (see `expected_jaccard`).
+    <seed>: seed of the hash functions.
+    <stats>: optional dictionary, filled with the number of "candidates"
+             and of "hits".
+
+    Returns (rows, cols, similarities) arrays, with rows < cols.
+    """
+    if bands is None:
+        bands = choose_bands(num_perm, expected_jaccard(threshold, k))
+    signatures = minhash_signatures(lseq, k=k, num_perm=num_perm, seed=seed)
+    rows, cols = lsh_candidate_pairs(signatures, bands)
+    result = verify_pairs(lseq, rows, cols, threshold)
+    if stats is not None:
+        stats["candidates"] = len(rows)
+        stats["hits"] = len(result[0])
+    return result
+
+
+def near_duplicate_clusters(n, rows, cols):
+    """Clusters of near-duplicates: connected components of the graph of
+    the pairs (rows[p], cols[p]) between <n> sequences.
+
+    Returns an array of <n> cluster labels, from 0 to the number of
+    clusters - 1.
+
+    >>> near_duplicate_clusters(5, np.array([0, 3]), np.array([2, 4]))
+    array([0, 1, 0, 2, 2])
+    """
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(rows, cols):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    roots = np.array([find(i) for i in range(n)])
+    return np.unique(roots, return_inverse=True)[1].ravel()
+
+
+def minhash_recall(lseq, threshold, sample_size=1000, seed=0, **kwargs):
+    """Estimates the recall of `near_duplicate_pairs` on a random sample of
+    <sample_size> sequences of <lseq> (which must have the same length):
+    the fraction of the pairs above <threshold> in the exact similarity
+    matrix of the sample which are found. Other keyword arguments are
+    passed to `near_duplicate_pairs`.
+
+    Returns a dictionary with the number of "exact" pairs, of pairs
+    "found", of "candidates" and the "recall".
+    """
+    rng = np.random.default_rng(seed)
+    lseq = list(lseq)
+    sample = rng.choice(len(lseq), min(sample_size, len(lseq)), replace=False)
+    sample_seqs = [lseq[i] for i in sample]
+
+    sim = sequence_similarity_mat_onehot(sample_seqs)
+    exact = set(zip(*np.nonzero(np.triu(sim >= threshold - 1e-12, 1))))
+
+    stats = {}
+    rows, cols, _ = near_duplicate_pairs(sample_seqs, threshold, stats=stats, **kwargs)
+    found = set(zip(rows, cols))
+
+    report = {
+        "exact": len(exact),
+        "found": len(exact & found),
+        "candidates": stats["candidates"],
+        "recall": len(exact & found) / len(exact) if exact else 1.0,
+    }
+    print(
+        "{found}/{exact} pairs found (recall {recall:.1%}), "
+        "{candidates} candidate pairs verified".format(**report)
+    )
+    return report
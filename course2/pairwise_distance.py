@@ -0,0 +1,732 @@
+"""Pairwise Euclidean distances between the rows of a matrix.
+
+The functions `pairwise_distance`, `pairwise_distance_numpy`,
+`pairwise_distance_numba_prange` and `compute_distance_row` are the ones
+of the course notebooks. They compute both D[i, j] and D[j, i] and store
+them in a full n x n matrix: with `condensed=True`, they only compute the
+upper triangle and store it in a `CondensedDistanceMatrix`, which takes
+half the memory.
+"""
+
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+from sequence_similarity import (
+    attach_shared_array,
+    balanced_row_blocks,
+    create_shared_array,
+    empty_shared_array,
+)
+from task_batching import print_dispatch_report, run_batched
+
+try:
+    from numba import njit, prange
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+class CondensedDistanceMatrix:
+    """Symmetric distance matrix with a zero diagonal, stored as its upper
+    triangle: the n * (n - 1) / 2 distances D[i, j], i < j, in row order
+    (the same layout as the output of `scipy.spatial.distance.pdist`).
+
+    Attributes:
+        n: number of rows (and columns) of the matrix.
+        data: 1-dimensional array of the distances of the upper triangle,
+              which can be passed to `scipy.spatial.distance.squareform`.
+
+    >>> D = CondensedDistanceMatrix(3, np.array([1.0, 2.0, 3.0]))
+    >>> float(D[2, 1]), float(D[1, 1])
+    (3.0, 0.0)
+    >>> D.row(1)
+    array([1., 0., 3.])
+    >>> float(D[-1, 0])
+    2.0
+    >>> D[0, 3]
+    Traceback (most recent call last):
+        ...
+    IndexError: index 3 is out of bounds for a matrix of 3 rows
+    >>> D.to_square()
+    array([[0., 1., 2.],
+           [1., 0., 3.],
+           [2., 3., 0.]])
+    """
+
+    def __init__(self, n, data=None, dtype=np.float64):
+        self.n = n
+        size = n * (n - 1) // 2
+        if data is None:
+            data = np.zeros(size, dtype=dtype)
+        elif len(data) != size:
+            raise ValueError(
+                "a condensed matrix of {} rows has {} values, not {}".format(
+                    n, size, len(data)
+                )
+            )
+        self.data = data
+
+    def check_index(self, i):
+        """Returns the row (or column) index <i>, with negative values
+        counted from the end as for numpy arrays.
+
+        Raises IndexError if it is out of bounds.
+        """
+        if not -self.n <= i < self.n:
+            raise IndexError(
+                "index {} is out of bounds for a matrix of {} rows".format(i, self.n)
+            )
+        return i + self.n if i < 0 else i
+
+    def row_start(self, i):
+        """Position in `data` of D[i, i + 1], the first value of row i."""
+        return self.n * i - i * (i + 1) // 2
+
+    def index(self, i, j):
+        """Position in `data` of D[i, j], for i != j."""
+        i, j = self.check_index(i), self.check_index(j)
+        if i > j:
+            i, j = j, i
+        return self.row_start(i) + j - i - 1
+
+    def __getitem__(self, ij):
+        i, j = self.check_index(ij[0]), self.check_index(ij[1])
+        if i == j:
+            return self.data.dtype.type(0)
+        return self.data[self.index(i, j)]
+
+    def __setitem__(self, ij, value):
+        i, j = self.check_index(ij[0]), self.check_index(ij[1])
+        if i == j:
+            raise IndexError("the diagonal of a condensed matrix is always 0")
+        self.data[self.index(i, j)] = value
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def shape(self):
+        return (self.n, self.n)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def upper_row(self, i):
+        """Distances D[i, i + 1:], as a view on `data`."""
+        i = self.check_index(i)
+        start = self.row_start(i)
+        return self.data[start : start + self.n - i - 1]
+
+    def row(self, i):
+        """Row i of the square matrix, as a new array."""
+        i = self.check_index(i)
+        row = np.zeros(self.n, dtype=self.data.dtype)
+        # D[j, i] for j < i: one value in each of the rows before i.
+        j = np.arange(i)
+        row[:i] = self.data[self.n * j - j * (j + 1) // 2 + i - j - 1]
+        row[i + 1 :] = self.upper_row(i)
+        return row
+
+    def to_square(self):
+        """Returns the full n x n matrix."""
+        square = np.zeros((self.n, self.n), dtype=self.data.dtype)
+        i, j = np.triu_indices(self.n, 1)
+        square[i, j] = self.data
+        square[j, i] = self.data
+        return square
+
+    @classmethod
+    def from_square(cls, square):
+        """Condensed form of a symmetric n x n matrix."""
+        square = np.asarray(square)
+        i, j = np.triu_indices(len(square), 1)
+        return cls(len(square), square[i, j].copy())
+
+
+def pairwise_distance(X, condensed=False):
+    """Compute pairwise Euclidean distances between the rows of `X`, in pure
+    python.
+
+    Arguments:
+        X: a 2-dimensional numpy array (matrix) of numbers, or any nested
+           sequence of sequences that all have the same length.
+        condensed: if True, only compute the upper triangle and return it as
+           a `CondensedDistanceMatrix`, instead of a list of lists.
+    """
+    num_vectors = len(X)
+    num_measurements = len(X[0])
+
+    if condensed:
+        D = CondensedDistanceMatrix(num_vectors)
+        for i in range(num_vectors):
+            for j in range(i + 1, num_vectors):
+                d = []
+                for k in range(num_measurements):
+                    d.append((X[i][k] - X[j][k]) ** 2)
+                D[i, j] = sum(d) ** 0.5
+        return D
+
+    D = [[0] * num_vectors for x in range(num_vectors)]
+    for i in range(num_vectors):
+        for j in range(num_vectors):
+            d = []
+            for k in range(num_measurements):
+                d.append((X[i][k] - X[j][k]) ** 2)
+            D[i][j] = sum(d) ** 0.5
+    return D
+
+
+def pairwise_distance_numpy(X, condensed=False):
+    """Compute pairwise Euclidean distances between the rows of `X`.
+
+    Arguments:
+        X: a 2-dimensional numpy array.
+        condensed: if True, only compute the upper triangle and return it as
+           a `CondensedDistanceMatrix`.
+    """
+    num_vectors = X.shape[0]
+
+    if condensed:
+        D = CondensedDistanceMatrix(num_vectors)
+        for i in range(num_vectors):
+            # distances to all the following rows at once.
+            D.upper_row(i)[:] = np.sqrt(np.sum(np.square(X[i + 1 :] - X[i]), axis=1))
+        return D
+
+    D = np.empty((num_vectors, num_vectors), dtype=np.float64)
+    for i in range(num_vectors):
+        for j in range(num_vectors):
+            d = np.square(np.subtract(X[i], X[j]))
+            D[i, j] = np.sqrt(np.sum(d))
+    return D
+
+
+if NUMBA_AVAILABLE:
+
+    @njit(parallel=True, cache=True)
+    def pairwise_distance_numba_square(X):
+        """Full distance matrix, from the multiprocessing notebook."""
+        num_vectors = X.shape[0]
+        num_measurements = X.shape[1]
+        D = np.empty((num_vectors, num_vectors), dtype=np.float64)
+
+        for i in prange(num_vectors):
+            for j in range(num_vectors):
+                d = 0.0
+                for k in range(num_measurements):
+                    d += (X[i, k] - X[j, k]) ** 2
+                D[i, j] = np.sqrt(d)
+        return D
+
+    @njit(parallel=True, cache=True)
+    def pairwise_distance_numba_condensed(X):
+        """Upper triangle of the distance matrix, in condensed order.
+
+        Row i has n - i - 1 distances, so iteration r of the parallel loop
+        computes both row r and row n - 2 - r, to balance the work.
+        """
+        n = X.shape[0]
+        num_measurements = X.shape[1]
+        data = np.empty(n * (n - 1) // 2, dtype=np.float64)
+
+        for r in prange(n // 2):
+            for m in range(1 if r == n - 2 - r else 2):
+                i = r + m * (n - 2 - 2 * r)  # r, then n - 2 - r
+                start = n * i - i * (i + 1) // 2
+                for j in range(i + 1, n):
+                    d = 0.0
+                    for k in range(num_measurements):
+                        d += (X[i, k] - X[j, k]) ** 2
+                    data[start + j - i - 1] = np.sqrt(d)
+        return data
+
+
+def pairwise_distance_numba_prange(X, condensed=False):
+    """Compute pairwise Euclidean distances between the rows of `X` with a
+    parallel numba loop.
+
+    Arguments:
+        X: a 2-dimensional numpy array.
+        condensed: if True, only compute the upper triangle and return it as
+           a `CondensedDistanceMatrix`.
+    """
+    if not NUMBA_AVAILABLE:
+        raise ImportError("numba is not installed")
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    if condensed:
+        return CondensedDistanceMatrix(len(X), pairwise_distance_numba_condensed(X))
+    return pairwise_distance_numba_square(X)
+
+
+# Data used by `compute_distance_row`, set by the caller (or by the pool
+# initializer) before mapping the function on row indexes.
+DATA_GLOB = None
+
+
+def compute_distance_row(i, upper=False):
+    """Distances between row i of DATA_GLOB and all its rows, or only the
+    rows after i if <upper> (i.e. row i of a `CondensedDistanceMatrix`).
+    """
+    others = DATA_GLOB[i + 1 :] if upper else DATA_GLOB
+    squared_diff = (others - DATA_GLOB[i]) ** 2
+    sums = np.sum(squared_diff, axis=1)
+    return np.sqrt(sums)
+
+
+def condensed_from_rows(n, upper_rows):
+    """Assembles the results of `compute_distance_row(i, upper=True)` for
+    i in range(n) (in this order) into a `CondensedDistanceMatrix`.
+    """
+    data = np.concatenate(list(upper_rows)) if n > 1 else np.zeros(0)
+    return CondensedDistanceMatrix(n, data)
+
+
+# ******************************************************************************
+# Parallel computation, on data in shared memory.
+# ******************************************************************************
+
+# Minimum amount of work (number of distances x number of columns) of a
+# block of rows sent to a worker, so that each task lasts at least a few
+# milliseconds and the scheduling overhead stays small.
+MIN_BLOCK_WORK = 2**22
+
+WORKER_OUTPUT = {}
+
+
+def auto_nb_blocks(n, m, nb_jobs):
+    """Number of blocks of rows for `pairwise_distance_parallel`: 4 per
+    process (for load balancing), unless the blocks would then be smaller
+    than MIN_BLOCK_WORK.
+
+    >>> auto_nb_blocks(10000, 100, 4), auto_nb_blocks(500, 10, 4)
+    (16, 1)
+    """
+    work = n * (n - 1) // 2 * max(1, m)
+    return int(min(4 * nb_jobs, max(1, work // MIN_BLOCK_WORK)))
+
+
+def init_data_worker(data_spec):
+    """Pool initializer: maps the shared data as DATA_GLOB, so that
+    `compute_distance_row` can be used as in the notebook. <data_spec> is
+    a (name, shape, dtype) tuple.
+    """
+    global DATA_GLOB
+    DATA_GLOB, WORKER_OUTPUT["data_shm"] = attach_shared_array(*data_spec)
+
+
+def init_distance_worker(data_spec, output_spec, condensed):
+    """Pool initializer: maps the shared data (see `init_data_worker`) and
+    the shared output, a n x n matrix or the data of a
+    `CondensedDistanceMatrix`. Each spec is a (name, shape, dtype) tuple.
+    """
+    init_data_worker(data_spec)
+    output, WORKER_OUTPUT["output_shm"] = attach_shared_array(*output_spec)
+    if condensed:
+        output = CondensedDistanceMatrix(len(DATA_GLOB), output)
+    WORKER_OUTPUT["output"] = output
+
+
+def distance_rows_task(bounds):
+    """Computes the rows start:stop of the upper triangle of the shared
+    distance matrix, and writes them (and, for a square matrix, the
+    symmetric columns) directly in the shared output. Only the (start,
+    stop) bounds are sent to the worker, and nothing is sent back.
+    """
+    start, stop = bounds
+    output = WORKER_OUTPUT["output"]
+    for i in range(start, stop):
+        row = compute_distance_row(i, upper=True)
+        if isinstance(output, CondensedDistanceMatrix):
+            output.upper_row(i)[:] = row
+        else:
+            output[i, i + 1 :] = row
+            output[i + 1 :, i] = row
+    return stop - start
+
+
+def pairwise_distance_parallel(
+    X, nb_jobs=None, condensed=False, nb_blocks=None, start_method=None, out=None
+):
+    """Same as `pairwise_distance`, with <nb_jobs> processes (by default,
+    one per CPU) running `compute_distance_row`.
+
+    Unlike mapping `compute_distance_row` on a pool, this does not rely on
+    DATA_GLOB being inherited by fork: <X> is copied once in shared memory
+    and mapped by each worker, and the workers write their rows directly in
+    a shared output, so no data nor result is pickled. It therefore works
+    the same with the "fork", "spawn" and "forkserver" <start_method>s
+    (None: the default of the platform).
+
+    Only the upper triangle is computed, split in <nb_blocks> blocks of rows
+    with the same number of distances (see `balanced_row_blocks`; by
+    default, chosen by `auto_nb_blocks`), the largest blocks first.
+
+    <out>: optional (array, SharedMemory) pair returned by
+           `empty_shared_array(shape)`, with shape (n, n), or
+           (n * (n - 1) // 2,) if <condensed>. The workers write in this
+           array, which is returned (or wrapped) without copy; the caller
+           keeps ownership of the shared memory block and must close and
+           unlink it. Without <out>, the result is copied out of a
+           temporary shared memory block, which doubles the peak memory.
+
+    Note that with "spawn", this module must be importable by the workers
+    and the caller protected by `if __name__ == "__main__":`.
+    """
+    if nb_jobs is None:
+        nb_jobs = mp.cpu_count()
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    n, m = X.shape
+    if nb_blocks is None:
+        nb_blocks = auto_nb_blocks(n, m, nb_jobs)
+
+    shape = (n * (n - 1) // 2,) if condensed else (n, n)
+    if out is not None:
+        if out[0].shape != shape or out[0].dtype != np.float64:
+            raise ValueError("out must be a float64 array of shape {}".format(shape))
+        if not condensed:
+            np.fill_diagonal(out[0], 0.0)
+    if n < 2:
+        D = np.zeros(shape) if out is None else out[0]
+        return CondensedDistanceMatrix(n, D) if condensed else D
+
+    blocks = balanced_row_blocks(n, nb_blocks)
+    blocks.sort(key=lambda b: b[0] - b[1])  # largest blocks first
+
+    shared_data, data_shm = create_shared_array(X)
+    shared_output, output_shm = empty_shared_array(shape) if out is None else out
+    data_spec = (data_shm.name, shared_data.shape, shared_data.dtype)
+    output_spec = (output_shm.name, shared_output.shape, shared_output.dtype)
+
+    try:
+        context = mp.get_context(start_method)
+        with context.Pool(
+            nb_jobs,
+            initializer=init_distance_worker,
+            initargs=(data_spec, output_spec, condensed),
+        ) as pool:
+            for _ in pool.imap_unordered(distance_rows_task, blocks):
+                pass
+        D = shared_output if out is not None else shared_output.copy()
+    finally:
+        del shared_data, shared_output
+        owned = [data_shm] if out is not None else [data_shm, output_shm]
+        for shm in owned:
+            shm.close()
+            shm.unlink()
+
+    return CondensedDistanceMatrix(n, D) if condensed else D
+
+
+def distance_rows_range(start, stop):
+    """Rows start:stop of the distance matrix of DATA_GLOB, computed with
+    `compute_distance_row` (a task of `pairwise_distance_batched`).
+    """
+    rows = np.empty((stop - start, len(DATA_GLOB)))
+    for i in range(start, stop):
+        rows[i - start] = compute_distance_row(i)
+    return rows
+
+
+def pairwise_distance_batched(
+    X, nb_jobs=None, batch_size=None, start_method=None, report=None
+):
+    """Same as `pairwise_distance`, with a pool of <nb_jobs> processes
+    computing batches of rows with `compute_distance_row`.
+
+    This replaces the one-task-per-pair version of the notebook (`pool.map`
+    on the list of `pairwise_list_I`): tasks are (row start, row stop)
+    ranges, with a batch size chosen from the measured cost of a row (see
+    `task_batching.run_batched`, which also describes <report>). <X> is
+    shared with the workers as in `pairwise_distance_parallel`, but the
+    rows are sent back to the parent.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    n = len(X)
+    if n == 0:
+        return np.zeros((0, 0))
+
+    shared_data, data_shm = create_shared_array(X)
+    data_spec = (data_shm.name, shared_data.shape, shared_data.dtype)
+    try:
+        blocks = run_batched(
+            distance_rows_range,
+            n,
+            nb_jobs,
+            batch_size=batch_size,
+            # each task returns at most ~TILE_BYTES of rows.
+            max_batch_size=max(1, TILE_BYTES // (8 * n)),
+            initializer=init_data_worker,
+            initargs=(data_spec,),
+            start_method=start_method,
+            report=report,
+        )
+    finally:
+        del shared_data
+        data_shm.close()
+        data_shm.unlink()
+    return np.concatenate(blocks)
+
+
+def dispatch_overhead_benchmark(X, nb_jobs=None, batch_sizes=(1, 8, None)):
+    """Times `pairwise_distance_batched` on <X> for each of <batch_sizes>
+    (None: chosen automatically) and prints the dispatch overhead of each,
+    compared to the serial map of `compute_distance_row`.
+
+    Returns a dictionary {batch size: report}.
+    """
+    global DATA_GLOB
+    DATA_GLOB = np.asarray(X, dtype=np.float64)
+    start = time.perf_counter()
+    reference = np.array(list(map(compute_distance_row, range(len(DATA_GLOB)))))
+    print("serial: {:.3f}s".format(time.perf_counter() - start))
+
+    reports = {}
+    for batch_size in batch_sizes:
+        report = {}
+        D = pairwise_distance_batched(X, nb_jobs, batch_size=batch_size, report=report)
+        if not np.allclose(D, reference):
+            print("Warning: results differ from the serial implementation")
+        label = "auto" if batch_size is None else batch_size
+        print_dispatch_report(report, label="batch size {}: ".format(label))
+        reports[label] = report
+    return reports
+
+
+# ******************************************************************************
+# Blocked distance engine, with matrix products.
+# ******************************************************************************
+
+# Memory budget (in bytes) of the block of distances computed at once by
+# `pairwise_distance_gemm`.
+TILE_BYTES = 2**24
+
+
+def prepare_distance_data(X, Y=None, dtype=np.float64):
+    """Centers `X` and `Y` (on the mean of both), converts them to <dtype>
+    and computes the squared norms of their rows. If `Y` is None, the
+    returned Y and its norms are the same arrays as for X.
+
+    Returns (X, Y, x_norms, y_norms).
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if Y is None:
+        X = (X - X.mean(axis=0)).astype(dtype)
+        x_norms = np.einsum("ij,ij->i", X, X)
+        return X, X, x_norms, x_norms
+
+    Y = np.asarray(Y, dtype=np.float64)
+    center = np.vstack((X, Y)).mean(axis=0)
+    X = (X - center).astype(dtype)
+    Y = (Y - center).astype(dtype)
+    return X, Y, np.einsum("ij,ij->i", X, X), np.einsum("ij,ij->i", Y, Y)
+
+
+def squared_distance_block(X, x_norms, Y, y_norms):
+    """Squared distances between the rows of `X` and `Y`, given their
+    squared norms, as ||x||^2 + ||y||^2 - 2 X.Y^T (negative values due to
+    rounding errors are set to 0).
+    """
+    block = X @ Y.T
+    block *= -2
+    block += x_norms[:, np.newaxis]
+    block += y_norms[np.newaxis, :]
+    np.maximum(block, 0, out=block)
+    return block
+
+
+def pairwise_distance_gemm(
+    X, Y=None, dtype=np.float64, tile_bytes=TILE_BYTES, condensed=False
+):
+    """Compute pairwise Euclidean distances between the rows of `X` (and the
+    rows of `Y`, if given) with the expansion
+    ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b, where all the dot products of a
+    block of rows are computed by a single matrix product (BLAS).
+
+    Arguments:
+        X: a 2-dimensional numpy array.
+        Y: an optional 2-dimensional numpy array with the same number of
+           columns as X. If None, the distances between the rows of X are
+           computed, and only for the blocks of the upper triangle.
+        dtype: np.float64 or np.float32. float32 is about twice as fast and
+           takes half the memory, but is less accurate (see
+           `distance_error_report`).
+        tile_bytes: memory budget (in bytes) of the block of distances
+           computed at once, which bounds the temporary memory used.
+        condensed: if True (and Y is None), return a
+           `CondensedDistanceMatrix`.
+
+    The data are centered first (distances do not change), which limits the
+    loss of precision of the expansion when the norms are large compared
+    to the distances. Rounding errors can still make the squared distance
+    slightly negative: it is clamped to 0 before the square root.
+    """
+    symmetric = Y is None
+    X, Y, x_norms, y_norms = prepare_distance_data(X, Y, dtype)
+    n, m = len(X), len(Y)
+    block_rows = max(1, tile_bytes // (np.dtype(dtype).itemsize * max(1, m)))
+
+    if condensed:
+        if not symmetric:
+            raise ValueError("condensed distances are only defined for Y=None")
+        D = CondensedDistanceMatrix(n, dtype=dtype)
+    else:
+        D = np.empty((n, m), dtype=dtype)
+
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        # in the symmetric case, only the columns from <start>.
+        first_col = start if symmetric else 0
+        block = squared_distance_block(
+            X[start:stop], x_norms[start:stop], Y[first_col:], y_norms[first_col:]
+        )
+        np.sqrt(block, out=block)
+
+        if condensed:
+            for i in range(start, stop):
+                D.upper_row(i)[:] = block[i - start, i + 1 - first_col :]
+        else:
+            D[start:stop, first_col:] = block
+            if symmetric:
+                D[start:, start:stop] = block.T
+                D[np.arange(start, stop), np.arange(start, stop)] = 0
+    return D
+
+
+def distance_error_report(X, dtype=np.float32, nb_rows=500, seed=0):
+    """Compares `pairwise_distance_gemm` in precision <dtype> with the exact
+    per-pair formula (`pairwise_distance_numpy`, in float64), on a random
+    sample of <nb_rows> rows of `X`.
+
+    Returns a dictionary with the maximum absolute error, the maximum
+    relative error (on the pairs with a non-zero distance) and the mean
+    absolute error.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.asarray(X, dtype=np.float64)
+    sample = X[rng.choice(len(X), min(nb_rows, len(X)), replace=False)]
+
+    exact = pairwise_distance_numpy(sample, condensed=True).data
+    approx = pairwise_distance_gemm(sample, dtype=dtype, condensed=True).data
+    errors = np.abs(approx.astype(np.float64) - exact)
+    nonzero = exact > 0
+
+    report = {
+        "max abs error": float(errors.max(initial=0)),
+        "max rel error": float((errors[nonzero] / exact[nonzero]).max(initial=0)),
+        "mean abs error": float(errors.mean()) if len(errors) else 0.0,
+    }
+    print(
+        "{}: max abs error {:.3g}, max rel error {:.3g}, mean abs error {:.3g}".format(
+            np.dtype(dtype).name,
+            report["max abs error"],
+            report["max rel error"],
+            report["mean abs error"],
+        )
+    )
+    return report
+
+
+# ******************************************************************************
+# Nearest neighbours.
+# ******************************************************************************
+
+
+def k_nearest_neighbors(
+    X, k, Y=None, method="auto", dtype=np.float64, tile_bytes=TILE_BYTES
+):
+    """Finds the <k> nearest neighbours (Euclidean distance) of each row of
+    `X`, among the rows of `Y`, or among the other rows of `X` if `Y` is
+    None.
+
+    Arguments:
+        X: a 2-dimensional numpy array.
+        k: number of neighbours.
+        Y: an optional 2-dimensional numpy array of candidate neighbours.
+        method: "brute": distances are computed by blocks of rows (see
+                `pairwise_distance_gemm`) and only the k smallest of each
+                row are kept, with np.argpartition. Memory is O(n * k) plus
+                one block of <tile_bytes>.
+            "kdtree": uses a scipy KD-tree, much faster for data with few
+                columns.
+            "auto": "kdtree" if scipy is installed and X has at most 16
+                columns, "brute" otherwise.
+        dtype, tile_bytes: see `pairwise_distance_gemm` (brute method only).
+
+    Returns (indices, distances), two (n x k) arrays, each row sorted by
+    increasing distance.
+
+    >>> X = np.array([[0.0], [1.0], [3.0], [7.0]])
+    >>> indices, distances = k_nearest_neighbors(X, 2, method="brute")
+    >>> indices
+    array([[1, 2],
+           [0, 2],
+           [1, 0],
+           [2, 1]])
+    """
+    X = np.asarray(X)
+    nb_candidates = len(X) - 1 if Y is None else len(Y)
+    if not 0 < k <= nb_candidates:
+        raise ValueError(
+            "k must be between 1 and the number of candidate neighbours "
+            "({})".format(nb_candidates)
+        )
+
+    if method == "auto":
+        try:
+            import scipy.spatial  # noqa: F401
+
+            method = "kdtree" if X.shape[1] <= 16 else "brute"
+        except ImportError:
+            method = "brute"
+
+    if method == "kdtree":
+        return k_nearest_neighbors_kdtree(X, k, Y)
+    if method != "brute":
+        raise ValueError("unknown method: {}".format(method))
+
+    symmetric = Y is None
+    X, Y, x_norms, y_norms = prepare_distance_data(X, Y, dtype)
+    n = len(X)
+    block_rows = max(1, tile_bytes // (np.dtype(dtype).itemsize * len(Y)))
+
+    indices = np.empty((n, k), dtype=np.intp)
+    distances = np.empty((n, k), dtype=dtype)
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        block = squared_distance_block(X[start:stop], x_norms[start:stop], Y, y_norms)
+        rows = np.arange(stop - start)
+        if symmetric:
+            # a row is not its own neighbour.
+            block[rows, np.arange(start, stop)] = np.inf
+
+        nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+        nearest_d2 = block[rows[:, np.newaxis], nearest]
+        order = np.argsort(nearest_d2, axis=1, kind="stable")
+        indices[start:stop] = np.take_along_axis(nearest, order, axis=1)
+        distances[start:stop] = np.sqrt(np.take_along_axis(nearest_d2, order, axis=1))
+    return indices, distances
+
+
+def k_nearest_neighbors_kdtree(X, k, Y=None):
+    """Same as `k_nearest_neighbors`, with a scipy KD-tree."""
+    from scipy.spatial import cKDTree  # only needed for this function.
+
+    if Y is not None:
+        distances, indices = cKDTree(Y).query(X, k=k)
+        return indices.reshape(len(X), k), distances.reshape(len(X), k)
+
+    # k + 1 neighbours, as each row is found as its own nearest neighbour.
+    distances, indices = cKDTree(X).query(X, k=k + 1)
+    is_self = indices == np.arange(len(X))[:, np.newaxis]
+    # with duplicated rows, a row may not be listed first: drop the last
+    # neighbour of the rows where it is not found.
+    is_self[~is_self.any(axis=1), -1] = True
+    keep = ~is_self
+    return (
+        indices[keep].reshape(len(X), k),
+        distances[keep].reshape(len(X), k),
+    )
@@ -0,0 +1,199 @@
+"""Vectorized composition (GC%, base counts, k-mer frequencies) of a set of
+sequences.
+
+`computeGC_dict` of the profiling notebook loops over the sequences, and
+`computeGC` over their characters. Here the whole set of sequences is
+stored as a single byte buffer, with the offset of each sequence in it,
+and the composition of all sequences is computed at once with numpy.
+"""
+
+import numpy as np
+
+from fasta import iter_fasta
+from sequence_similarity import NUCLEOTIDE_CODES, as_bytes
+
+# Number of bytes of the buffer processed at once: bounds the size of the
+# temporary arrays (a few int64 per base, so ~100 MB for 4 MB of sequences).
+CHUNK_BYTES = 2**22
+
+
+def concatenate_sequences(lseq):
+    """Stores a list of sequences (`str` or `bytes`) in a single buffer.
+
+    Returns (buffer, offsets), where buffer is a uint8 array and sequence i
+    is buffer[offsets[i]:offsets[i + 1]].
+
+    >>> buffer, offsets = concatenate_sequences(["ACG", "TT"])
+    >>> bytes(buffer), offsets
+    (b'ACGTT', array([0, 3, 5]))
+    """
+    lseq = [as_bytes(s) for s in lseq]
+    offsets = np.zeros(len(lseq) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in lseq], out=offsets[1:])
+    buffer = np.concatenate(lseq) if lseq else np.zeros(0, dtype=np.uint8)
+    return buffer, offsets
+
+
+def read_sequence_buffer(filename):
+    """Reads a FASTA file into a single buffer.
+
+    Returns (names, buffer, offsets), see `concatenate_sequences`.
+    """
+    names = []
+    chunks = []
+    for name, seq in iter_fasta(filename):
+        names.append(name)
+        chunks.append(seq)
+    buffer, offsets = concatenate_sequences(chunks)
+    return names, buffer, offsets
+
+
+def record_chunks(offsets, chunk_bytes=None):
+    """Splits the records in groups of consecutive records of about
+    <chunk_bytes> bytes (CHUNK_BYTES by default) in total. A record longer
+    than that is a group on its own.
+
+    Yields (first record, last record + 1) tuples.
+    """
+    if chunk_bytes is None:
+        chunk_bytes = CHUNK_BYTES
+    n = len(offsets) - 1
+    first = 0
+    while first < n:
+        last = np.searchsorted(offsets, offsets[first] + chunk_bytes, side="right") - 1
+        last = min(max(last, first + 1), n)
+        yield first, last
+        first = last
+
+
+def count_bytes(buffer, offsets):
+    """Number of occurrences of each byte value in each sequence.
+
+    Returns a (number of sequences x 256) int64 array.
+    """
+    n = len(offsets) - 1
+    counts = np.zeros((n, 256), dtype=np.int64)
+    for first, last in record_chunks(offsets):
+        chunk = buffer[offsets[first] : offsets[last]]
+        records = np.repeat(np.arange(last - first), np.diff(offsets[first : last + 1]))
+        counts[first:last] = np.bincount(
+            records * 256 + chunk, minlength=(last - first) * 256
+        ).reshape(last - first, 256)
+    return counts
+
+
+def chunk_kmers(buffer, offsets, first, last, k):
+    """k-mers of the sequences first:last of a buffer (see `count_kmers`).
+
+    Returns (records, kmers): for each valid k-mer, the index of its
+    sequence (relative to <first>, in increasing order) and its 2-bit code,
+    as a uint64 (so k must be at most 32).
+    """
+    codes = NUCLEOTIDE_CODES[buffer[offsets[first] : offsets[last]]]
+    nb_windows = len(codes) - k + 1
+    if nb_windows <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+
+    kmers = np.zeros(nb_windows, dtype=np.uint64)
+    for t in range(k):
+        kmers = (kmers << np.uint64(2)) | (codes[t : t + nb_windows] & 3)
+
+    # a window is valid if it has no ambiguous code...
+    ambiguous = np.concatenate(([0], np.cumsum(codes == 4)))
+    valid = ambiguous[k:] == ambiguous[:nb_windows]
+    # ... and does not run over the end of its sequence.
+    lengths = np.diff(offsets[first : last + 1])
+    records = np.repeat(np.arange(last - first), lengths)[:nb_windows]
+    ends = (offsets[first + 1 : last + 1] - offsets[first])[records]
+    valid &= np.arange(nb_windows) + k <= ends
+
+    return records[valid], kmers[valid]
+
+
+def count_kmers(buffer, offsets, k):
+    """Number of occurrences of each k-mer in each sequence.
+
+    The k-mers are computed with a rolling 2-bit code: k-mer
+    b_0 b_1 ... b_{k-1} has index sum(code(b_t) * 4 ** (k - 1 - t)), with
+    A=0, C=1, G=2, T=3 (so columns are in lexicographic order, see
+    `kmer_names`). k-mers containing another character (N, lowercase...)
+    or overlapping two sequences are skipped.
+
+    Returns a (number of sequences x 4**k) int64 array.
+
+    >>> buffer, offsets = concatenate_sequences(["ACGT", "AANAA"])
+    >>> count_kmers(buffer, offsets, 2)[:, [0, 1, 6, 11]]  # AA, AC, CG, GT
+    array([[0, 1, 1, 1],
+           [2, 0, 0, 0]])
+    """
+    n = len(offsets) - 1
+    nb_kmers = 4**k
+    counts = np.zeros((n, nb_kmers), dtype=np.int64)
+
+    for first, last in record_chunks(offsets):
+        records, kmers = chunk_kmers(buffer, offsets, first, last, k)
+        counts[first:last] = np.bincount(
+            records * nb_kmers + kmers.astype(np.int64),
+            minlength=(last - first) * nb_kmers,
+        ).reshape(last - first, nb_kmers)
+    return counts
+
+
+def kmer_names(k):
+    """Names of the k-mers, in the order of the columns of `count_kmers`.
+
+    >>> kmer_names(1)
+    ['A', 'C', 'G', 'T']
+    """
+    names = [""]
+    for _ in range(k):
+        names = [name + base for name in names for base in "ACGT"]
+    return names
+
+
+def compute_composition(buffer, offsets, k=None, bases="ACGTN"):
+    """Computes the composition of all the sequences of a buffer (see
+    `concatenate_sequences`) in one pass.
+
+    Returns a dictionary of arrays, one value per sequence:
+        "length": number of characters of the sequence.
+        each character of <bases>: its number of occurrences.
+        "GC%": percentage of G and C, as computed by `computeGC` in the
+               profiling notebook (only upper case G and C are counted).
+        each k-mer, if <k> is given: its frequency among the valid k-mers
+               of the sequence (see `count_kmers`).
+    """
+    byte_counts = count_bytes(buffer, offsets)
+    lengths = np.diff(offsets)
+
+    composition = {"length": lengths}
+    for base in bases:
+        composition[base] = byte_counts[:, ord(base)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        composition["GC%"] = (
+            100 * (byte_counts[:, ord("G")] + byte_counts[:, ord("C")]) / lengths
+        )
+
+        if k is not None:
+            kmer_counts = count_kmers(buffer, offsets, k)
+            frequencies = kmer_counts / kmer_counts.sum(axis=1, keepdims=True)
+            for i, name in enumerate(kmer_names(k)):
+                composition[name] = frequencies[:, i]
+    return composition
+
+
+def composition_table(names, buffer, offsets, k=None, bases="ACGTN"):
+    """Same as `compute_composition`, returned as a pandas DataFrame
+    indexed by sequence name.
+
+    Example:
+        names, buffer, offsets = read_sequence_buffer("data/sequences.fas")
+        df = composition_table(names, buffer, offsets, k=3)
+        ordered_seq = df.sort_values("GC%").index
+    """
+    import pandas as pd  # only needed for this function.
+
+    return pd.DataFrame(
+        compute_composition(buffer, offsets, k=k, bases=bases),
+        index=pd.Index(names, name="name"),
+    )
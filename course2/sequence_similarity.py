@@ -0,0 +1,683 @@
+"""Fast implementations of the sequence similarity of the profiling notebook.
+
+The similarity between 2 sequences is the fraction of positions where they
+have the same character, as computed by `compute_sequence_similarity`.
+"""
+
+import multiprocessing as mp
+import time
+import timeit
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def compute_sequence_similarity(seqA, seqB):
+    """Compute similarity between 2 sequence as the fraction
+    of position where they have the same value.
+
+    Reference implementation, from the profiling notebook.
+    """
+    l = len(seqA)
+    similar = 0
+    for i in range(l):
+        if seqA[i] == seqB[i]:
+            similar += 1
+    return similar / l
+
+
+def sequence_similarity_mat(lseq):
+    """Compute similarity between all sequence pairs.
+
+    Reference implementation, from the profiling notebook.
+    """
+    sim = np.zeros((len(lseq), len(lseq)))
+    for i, s1 in enumerate(lseq):
+        for j, s2 in enumerate(lseq):
+            sim[i, j] = compute_sequence_similarity(s1, s2)
+    return sim
+
+
+def sequence_similarity_mat_numpy(lseq):
+    """Compute similarity between all sequence pairs, comparing the
+    sequences as numpy arrays.
+
+    From solution_22_numpy.py.
+    """
+    lseq_np = [np.array(list(s)) for s in lseq]
+
+    sim_matrix = np.zeros((len(lseq),) * 2)
+    for i, s1 in enumerate(lseq_np):
+        for j, s2 in enumerate(lseq_np):
+            if i < j:
+                continue
+            sim_matrix[i, j] = (s1 == s2).mean()
+            sim_matrix[j, i] = sim_matrix[i, j]
+    return sim_matrix
+
+
+# ******************************************************************************
+# Packed 2-bit encoding.
+# ******************************************************************************
+
+# 2-bit code of each nucleotide. Any other byte (N, lowercase, IUPAC
+# ambiguity codes...) is marked as ambiguous (code 4).
+NUCLEOTIDE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, nucleotide in enumerate(b"ACGT"):
+    NUCLEOTIDE_CODES[nucleotide] = code
+
+BASES_PER_WORD = 32
+# Mask selecting the low bit of each 2-bit base of a word.
+LOW_BITS = np.uint64(0x5555555555555555)
+BIT_SHIFTS = (2 * np.arange(BASES_PER_WORD)).astype(np.uint64)
+
+
+def as_bytes(seq):
+    """Returns a sequence given as `str` or `bytes` as a uint8 numpy array."""
+    if isinstance(seq, str):
+        seq = seq.encode("ascii")
+    return np.frombuffer(seq, dtype=np.uint8)
+
+
+def encode_sequences(lseq):
+    """Returns a list of sequences of the same length L (as `str`, `bytes`
+    or uint8 arrays) as a (number of sequences x L) uint8 array.
+
+    >>> encode_sequences(["AC", "GT"])
+    array([[65, 67],
+           [71, 84]], dtype=uint8)
+    """
+    if isinstance(lseq, np.ndarray) and lseq.dtype == np.uint8 and lseq.ndim == 2:
+        return lseq
+    lseq = [as_bytes(s) for s in lseq]
+    if len(lseq) == 0:
+        return np.zeros((0, 0), dtype=np.uint8)
+    if any(len(s) != len(lseq[0]) for s in lseq):
+        raise ValueError("all sequences must have the same length")
+    return np.stack(lseq)
+
+
+def pack_bases(codes):
+    """Packs an array of 2-bit codes (values 0 to 3) into uint64 words,
+    32 bases per word, the first base in the lowest bits.
+
+    >>> pack_bases(np.array([0, 1, 2, 3], dtype=np.uint8))
+    array([228], dtype=uint64)
+    """
+    nb_words = -(-len(codes) // BASES_PER_WORD)
+    padded = np.zeros(nb_words * BASES_PER_WORD, dtype=np.uint64)
+    padded[: len(codes)] = codes
+    return np.bitwise_or.reduce(
+        padded.reshape(nb_words, BASES_PER_WORD) << BIT_SHIFTS, axis=1
+    )
+
+
+def popcount(words):
+    """Number of bits set in each element of an unsigned integer array."""
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(words)
+    bytes_view = words.view(np.uint8).reshape(words.shape + (words.itemsize,))
+    return BYTE_POPCOUNT[bytes_view].sum(axis=-1)
+
+
+BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class PackedSequences:
+    """Compact store of nucleotide sequences, 2 bits per base.
+
+    Attributes:
+        words: (number of sequences x number of words) uint64 array, each
+               word holding 32 bases (A=0, C=1, G=2, T=3). Sequences are
+               padded with A up to the longest sequence.
+        lengths: length of each sequence.
+        ambiguous_mask: None if all bases are A, C, G or T. Otherwise an
+                        array shaped like `words` where both bits of the
+                        ambiguous positions are set.
+        ambiguous_offsets: the ambiguous positions of sequence i are
+                           stored in ambiguous_positions[a:b] and
+                           ambiguous_chars[a:b], with a, b =
+                           ambiguous_offsets[i], ambiguous_offsets[i + 1]
+                           (CSR layout), so that comparisons between them
+                           remain exact.
+        ambiguous_positions: positions of the ambiguous bases, per sequence.
+        ambiguous_chars: characters (uint8) of the ambiguous bases.
+        nb_ambiguous: number of ambiguous positions of each sequence.
+
+    A sequence of L bases takes L/4 bytes, instead of 4*L bytes as an array
+    of unicode characters (np.array(list(seq))) - a 16x reduction.
+    """
+
+    def __init__(self, lseq):
+        lseq = [as_bytes(s) for s in lseq]
+        self.lengths = np.array([len(s) for s in lseq], dtype=np.int64)
+        nb_words = -(-int(self.lengths.max(initial=0)) // BASES_PER_WORD)
+
+        self.words = np.zeros((len(lseq), nb_words), dtype=np.uint64)
+        self.ambiguous_mask = None
+        self.nb_ambiguous = np.zeros(len(lseq), dtype=np.int64)
+        positions_list = [np.zeros(0, dtype=np.int64)]
+        chars_list = [np.zeros(0, dtype=np.uint8)]
+
+        for i, seq in enumerate(lseq):
+            codes = NUCLEOTIDE_CODES[seq]
+            words = pack_bases(codes & 3)
+            self.words[i, : len(words)] = words
+
+            positions = np.flatnonzero(codes == 4)
+            if len(positions) > 0:
+                self.nb_ambiguous[i] = len(positions)
+                positions_list.append(positions)
+                chars_list.append(seq[positions])
+                if self.ambiguous_mask is None:
+                    self.ambiguous_mask = np.zeros_like(self.words)
+                flags = np.zeros(len(codes), dtype=np.uint8)
+                flags[positions] = 3
+                self.ambiguous_mask[i, : len(words)] = pack_bases(flags)
+
+        self.ambiguous_offsets = np.zeros(len(lseq) + 1, dtype=np.int64)
+        np.cumsum(self.nb_ambiguous, out=self.ambiguous_offsets[1:])
+        self.ambiguous_positions = np.concatenate(positions_list)
+        self.ambiguous_chars = np.concatenate(chars_list)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def nbytes(self):
+        """Memory used by the packed sequences, in bytes."""
+        nbytes = self.words.nbytes + self.lengths.nbytes
+        nbytes += self.nb_ambiguous.nbytes + self.ambiguous_offsets.nbytes
+        nbytes += self.ambiguous_positions.nbytes + self.ambiguous_chars.nbytes
+        if self.ambiguous_mask is not None:
+            nbytes += self.ambiguous_mask.nbytes
+        return nbytes
+
+    def ambiguous_bases(self, i):
+        """(positions, characters) of the ambiguous bases of sequence <i>."""
+        start, stop = self.ambiguous_offsets[i], self.ambiguous_offsets[i + 1]
+        return self.ambiguous_positions[start:stop], self.ambiguous_chars[start:stop]
+
+    def count_identities(self, i, others):
+        """Number of positions where sequence <i> is identical to each of
+        the sequences with indexes <others> (an array of indexes).
+
+        Sequences must have the same length as sequence <i>.
+        """
+        # XOR: the 2 bits of a base are 0 where both sequences are identical.
+        diff = self.words[i] ^ self.words[others]
+        if self.ambiguous_mask is not None:
+            # ambiguous positions are counted as mismatches, then corrected.
+            diff |= self.ambiguous_mask[i] | self.ambiguous_mask[others]
+        mismatches = popcount((diff | (diff >> np.uint64(1))) & LOW_BITS).sum(axis=1)
+        identities = self.lengths[i] - mismatches.astype(np.int64)
+
+        if self.nb_ambiguous[i] > 0:
+            positions_i, chars_i = self.ambiguous_bases(i)
+            others = np.atleast_1d(others)
+            for k in np.flatnonzero(self.nb_ambiguous[others]):
+                positions_j, chars_j = self.ambiguous_bases(others[k])
+                _, idx_i, idx_j = np.intersect1d(
+                    positions_i, positions_j, assume_unique=True, return_indices=True
+                )
+                identities[k] += np.count_nonzero(chars_i[idx_i] == chars_j[idx_j])
+
+        return identities
+
+
+def sequence_similarity_packed(packed, i, j):
+    """Similarity between sequences <i> and <j> of a `PackedSequences`,
+    comparing 32 bases at a time with XOR + popcount.
+
+    >>> packed = PackedSequences(["AAAGC", "ATAGG", "TTACN"])
+    >>> float(sequence_similarity_packed(packed, 0, 1))
+    0.6
+    """
+    if packed.lengths[i] != packed.lengths[j]:
+        raise ValueError("sequences {} and {} have different lengths".format(i, j))
+    return packed.count_identities(i, np.array([j]))[0] / packed.lengths[i]
+
+
+def sequence_similarity_mat_packed(lseq):
+    """Compute similarity between all sequence pairs, on the packed 2-bit
+    encoding of the sequences. All sequences must have the same length.
+
+    >>> sequence_similarity_mat_packed(["AAAGC", "ATAGG", "TTACC"])
+    array([[1. , 0.6, 0.4],
+           [0.6, 1. , 0.4],
+           [0.4, 0.4, 1. ]])
+    """
+    packed = lseq if isinstance(lseq, PackedSequences) else PackedSequences(lseq)
+    n = len(packed)
+    if n > 0 and np.any(packed.lengths != packed.lengths[0]):
+        raise ValueError("all sequences must have the same length")
+
+    sim = np.empty((n, n))
+    for i in range(n):
+        others = np.arange(i, n)
+        sim[i, i:] = packed.count_identities(i, others) / packed.lengths[i]
+        sim[i:, i] = sim[i, i:]
+    return sim
+
+
+# ******************************************************************************
+# One-hot encoding and matrix products.
+# ******************************************************************************
+
+
+def sequence_alphabet(lseq):
+    """Sorted uint8 array of the distinct characters of a list of sequences.
+
+    >>> bytes(sequence_alphabet(["TTAG", "GCAN"]))
+    b'ACGNT'
+    """
+    present = np.zeros(256, dtype=bool)
+    for s in lseq:
+        present[as_bytes(s)] = True
+    return np.flatnonzero(present).astype(np.uint8)
+
+
+def one_hot_encode(lseq, dtype=np.float32, alphabet=None):
+    """One-hot encodes a list of sequences of the same length L.
+
+    Returns (onehot, alphabet), where alphabet holds the distinct characters
+    (as bytes values) found in the sequences and onehot is a
+    (number of sequences x L * len(alphabet)) array of 0 and 1: position p of
+    a sequence holding alphabet[a] sets column p * len(alphabet) + a.
+
+    To encode a large set of sequences by parts, pass the <alphabet> of the
+    whole set (a sorted uint8 array, e.g. from `sequence_alphabet`).
+
+    The dot product of two rows is then the number of identical positions
+    of the two sequences.
+
+    >>> onehot, alphabet = one_hot_encode(["AC", "AG"])
+    >>> bytes(alphabet)
+    b'ACG'
+    >>> onehot
+    array([[1., 0., 0., 0., 1., 0.],
+           [1., 0., 0., 0., 0., 1.]], dtype=float32)
+    >>> one_hot_encode([])
+    (array([], shape=(0, 0), dtype=float32), array([], dtype=uint8))
+    """
+    if len(lseq) == 0:
+        return np.zeros((0, 0), dtype), np.zeros(0, np.uint8)
+    seqs = encode_sequences(lseq)
+    if alphabet is None:
+        alphabet = np.unique(seqs)
+    onehot = seqs[:, :, np.newaxis] == alphabet
+    return onehot.reshape(len(seqs), -1).astype(dtype), alphabet
+
+
+def sequence_similarity_mat_onehot(lseq, block_size=256, dtype=np.float32):
+    """Compute similarity between all sequence pairs with matrix products.
+
+    The sequences are one-hot encoded once (see `one_hot_encode`), then
+    the identity counts of all pairs are obtained as onehot @ onehot.T,
+    computed by blocks of <block_size> rows (BLAS matrix multiplies). Only
+    the blocks of the upper triangle are computed, the lower triangle is
+    filled by symmetry.
+
+    With float32, counts are exact for sequences of up to 2**24 bases.
+    Longer sequences are computed in float64.
+
+    >>> sequence_similarity_mat_onehot(["AAAGC", "ATAGG", "TTACC"])
+    array([[1. , 0.6, 0.4],
+           [0.6, 1. , 0.4],
+           [0.4, 0.4, 1. ]])
+    >>> sequence_similarity_mat_onehot([])
+    array([], shape=(0, 0), dtype=float64)
+    """
+    if len(lseq) > 0 and len(lseq[0]) > 2**24:
+        dtype = np.float64
+    onehot, alphabet = one_hot_encode(lseq, dtype=dtype)
+    n = len(onehot)
+    if n == 0:
+        return np.zeros((0, 0))
+
+    length = onehot.shape[1] // len(alphabet)
+    sim = np.empty((n, n))
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        block = onehot[start:stop] @ onehot[start:].T
+        sim[start:stop, start:] = block
+        sim[start:, start:stop] = block.T
+    sim /= length
+    return sim
+
+
+# ******************************************************************************
+# Compiled (numba) implementation.
+# ******************************************************************************
+
+if NUMBA_AVAILABLE:
+
+    @njit(parallel=True, cache=True)
+    def similarity_counts_numba(seqs):
+        """Number of identical positions between all pairs of rows of
+        <seqs>, a (number of sequences x L) uint8 array.
+
+        Only the upper triangle is computed. Row i has n - i pairs to
+        compute, so iteration r of the parallel loop handles both row r
+        and row n - 1 - r: all iterations have about the same amount of
+        work.
+        """
+        n, length = seqs.shape
+        counts = np.empty((n, n), dtype=np.int64)
+        for r in prange((n + 1) // 2):
+            # the middle row of an odd number of rows is only computed once.
+            for k in range(1 if r == n - 1 - r else 2):
+                i = r + k * (n - 1 - 2 * r)  # r, then n - 1 - r
+                for j in range(i, n):
+                    same = 0
+                    for p in range(length):
+                        if seqs[i, p] == seqs[j, p]:
+                            same += 1
+                    counts[i, j] = same
+                    counts[j, i] = same
+        return counts
+
+
+def sequence_similarity_mat_numba(lseq):
+    """Compute similarity between all sequence pairs with a compiled numba
+    kernel (see `similarity_counts_numba`) working on the sequences encoded
+    as a uint8 array. All sequences must have the same length.
+
+    The kernel is cached on disk (cache=True): it is only compiled the
+    first time, and not in each worker process.
+    """
+    if not NUMBA_AVAILABLE:
+        raise ImportError("numba is not installed")
+    seqs = encode_sequences(lseq)
+    if len(seqs) == 0:
+        return np.zeros((0, 0))
+    return similarity_counts_numba(seqs) / seqs.shape[1]
+
+
+# ******************************************************************************
+# Comparison of the implementations.
+# ******************************************************************************
+
+TEST_LSEQ = ["AAAGC", "ATAGG", "TTACC"]
+TEST_SIMILARITY = np.array([[1.0, 0.6, 0.4], [0.6, 1.0, 0.4], [0.4, 0.4, 1.0]])
+
+
+def check_similarity_implementations(implementations=None, lseq=None):
+    """Correctness test shared by all the implementations of the similarity
+    matrix: each function of <implementations> (a dictionary {name:
+    function}, `DEFAULT_IMPLEMENTATIONS` by default) must give the expected
+    matrix on a small test set, and the same result as
+    `sequence_similarity_mat` on <lseq> (by default, 50 random sequences of
+    200 bases including some N).
+
+    Returns a dictionary {name: True if the implementation is correct}.
+
+    >>> all(check_similarity_implementations().values())
+    True
+    """
+    if implementations is None:
+        implementations = DEFAULT_IMPLEMENTATIONS
+    if lseq is None:
+        rng = np.random.default_rng(0)
+        lseq = ["".join(rng.choice(list("ATGCN"), 200)) for x in range(50)]
+
+    reference = sequence_similarity_mat(lseq)
+    results = {}
+    for name, function in implementations.items():
+        results[name] = bool(
+            np.allclose(np.asarray(function(TEST_LSEQ)), TEST_SIMILARITY)
+            and np.allclose(np.asarray(function(lseq)), reference)
+        )
+    return results
+
+
+def benchmark_similarity_mat(lseq, implementations=None, nb_repeats=3):
+    """Times implementations of the all-vs-all similarity matrix on <lseq>.
+
+    <implementations> is a dictionary {name: function}, each function
+    taking the list of sequences and returning the similarity matrix. By
+    default, the implementations of `DEFAULT_IMPLEMENTATIONS` are timed.
+    The cython versions of the solutions (defined in notebook cells) can be
+    added, e.g.:
+
+        implementations = dict(DEFAULT_IMPLEMENTATIONS)
+        implementations["cython"] = sequence_similarity_mat_cython
+        benchmark_similarity_mat(lseq, implementations)
+
+    Each implementation is first checked with
+    `check_similarity_implementations`. Returns a
+    dictionary with the best time (in seconds) of each implementation.
+    """
+    if implementations is None:
+        implementations = DEFAULT_IMPLEMENTATIONS
+
+    for name, correct in check_similarity_implementations(
+        implementations, lseq
+    ).items():
+        if not correct:
+            print("Warning: {} disagrees with the reference".format(name))
+
+    times = {}
+    for name, function in implementations.items():
+        times[name] = min(
+            timeit.repeat(lambda: function(lseq), number=1, repeat=nb_repeats)
+        )
+
+    slowest = max(times.values())
+    for name, t in times.items():
+        print("{:<10}: {:.4f}s (x{:.1f})".format(name, t, slowest / t))
+    return times
+
+
+DEFAULT_IMPLEMENTATIONS = {
+    "python": sequence_similarity_mat,
+    "numpy": sequence_similarity_mat_numpy,
+    "packed": sequence_similarity_mat_packed,
+    "onehot": sequence_similarity_mat_onehot,
+}
+if NUMBA_AVAILABLE:
+    DEFAULT_IMPLEMENTATIONS["numba"] = sequence_similarity_mat_numba
+
+
+# ******************************************************************************
+# Parallel computation, on sequences in shared memory.
+# ******************************************************************************
+
+WORKER_SHARED = {}
+
+
+def create_shared_array(array):
+    """Copies <array> in a new shared memory block.
+
+    Returns the shared copy and the SharedMemory object: the caller is
+    responsible for calling close() and unlink() on it.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[:] = array
+    return shared, shm
+
+
+def empty_shared_array(shape, dtype=np.float64):
+    """Returns a zero-filled array in a new shared memory block, without
+    building it first in regular memory, and the SharedMemory object: the
+    caller is responsible for calling close() and unlink() on it.
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+    shared = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    shared.fill(0)
+    return shared, shm
+
+
+def attach_shared_array(name, shape, dtype):
+    """Returns a numpy array backed by the existing shared memory block
+    <name>, and the SharedMemory object which must be kept alive while the
+    array is used.
+    """
+    try:
+        # python >= 3.13: workers must not unlink the block when they exit.
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+def balanced_row_blocks(n, nb_blocks):
+    """Splits the rows of the upper triangle of a <n> x <n> matrix in
+    <nb_blocks> blocks of consecutive rows holding about the same number of
+    cells (row i has n - i cells): the first blocks have fewer rows than the
+    last ones.
+
+    Returns a list of (start, stop) tuples.
+
+    >>> balanced_row_blocks(10, 3)
+    [(0, 2), (2, 5), (5, 10)]
+    """
+    cells_before = np.arange(n + 1) * n - np.arange(n + 1) * (np.arange(n + 1) - 1) // 2
+    targets = np.linspace(0, cells_before[-1], nb_blocks + 1)
+    bounds = np.unique(np.searchsorted(cells_before, targets))
+    bounds[-1] = n
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if a < b]
+
+
+def compute_similarity_rows(seqs, start, stop, alphabet, sim, block_size=256):
+    """Computes the similarity of the sequences start:stop of <seqs> (a
+    number of sequences x L uint8 array) with the sequences start:, and
+    writes it in <sim> (an n x n array) at rows start:stop and, by
+    symmetry, at columns start:stop.
+    """
+    length = seqs.shape[1]
+    dtype = np.float32 if length <= 2**24 else np.float64
+    rows, _ = one_hot_encode(seqs[start:stop], dtype=dtype, alphabet=alphabet)
+    for col_start in range(start, len(seqs), block_size):
+        col_stop = min(col_start + block_size, len(seqs))
+        cols, _ = one_hot_encode(
+            seqs[col_start:col_stop], dtype=dtype, alphabet=alphabet
+        )
+        # the counts are exact in float32; the division is done in the
+        # dtype of <sim> so that the result matches the other versions.
+        block = sim[start:stop, col_start:col_stop]
+        block[:] = rows @ cols.T
+        block /= length
+        sim[col_start:col_stop, start:stop] = block.T
+
+
+def init_similarity_worker(seqs_spec, sim_spec, alphabet):
+    """Pool initializer: maps the shared sequences and similarity matrix in
+    the worker. Each spec is a (name, shape, dtype) tuple.
+    """
+    WORKER_SHARED["seqs"], WORKER_SHARED["seqs_shm"] = attach_shared_array(*seqs_spec)
+    WORKER_SHARED["sim"], WORKER_SHARED["sim_shm"] = attach_shared_array(*sim_spec)
+    WORKER_SHARED["alphabet"] = alphabet
+
+
+def similarity_rows_task(bounds):
+    """Computes a block of rows of the shared similarity matrix. Only the
+    (start, stop) bounds of the block are sent to the worker.
+    """
+    start, stop = bounds
+    compute_similarity_rows(
+        WORKER_SHARED["seqs"],
+        start,
+        stop,
+        WORKER_SHARED["alphabet"],
+        WORKER_SHARED["sim"],
+    )
+    return stop - start
+
+
+def sequence_similarity_mat_parallel(lseq, nb_jobs=None, nb_blocks=None, out=None):
+    """Compute similarity between all sequence pairs with <nb_jobs>
+    processes (by default, one per CPU).
+
+    The sequences, which must have the same length, are copied once as a
+    uint8 array in shared memory, and the workers write directly in a
+    shared similarity matrix: no sequence nor result is pickled. The upper
+    triangle is split in <nb_blocks> blocks of rows with the same number of
+    cells (see `balanced_row_blocks`; 4 blocks per process by default) and
+    the largest blocks are scheduled first.
+
+    <out>: optional (array, SharedMemory) pair returned by
+           `empty_shared_array((n, n))`. The workers write in this array,
+           which is returned as is; the caller keeps ownership of the shared
+           memory block and must close and unlink it. Without <out>, the
+           result is copied out of a temporary shared memory block, so two
+           n x n matrices are held in memory at the end.
+    """
+    if nb_jobs is None:
+        nb_jobs = mp.cpu_count()
+    if nb_blocks is None:
+        nb_blocks = 4 * nb_jobs
+
+    seqs = encode_sequences(lseq)
+    n = len(seqs)
+    if out is not None:
+        if out[0].shape != (n, n) or out[0].dtype != np.float64:
+            raise ValueError("out must be a ({0}, {0}) float64 array".format(n))
+    if n == 0:
+        return np.zeros((0, 0)) if out is None else out[0]
+
+    alphabet = sequence_alphabet(seqs)
+    blocks = balanced_row_blocks(n, nb_blocks)
+    blocks.sort(key=lambda b: b[0] - b[1])  # largest blocks first
+
+    shared_seqs, seqs_shm = create_shared_array(seqs)
+    shared_sim, sim_shm = empty_shared_array((n, n)) if out is None else out
+    seqs_spec = (seqs_shm.name, shared_seqs.shape, shared_seqs.dtype)
+    sim_spec = (sim_shm.name, shared_sim.shape, shared_sim.dtype)
+
+    try:
+        with mp.Pool(
+            nb_jobs,
+            initializer=init_similarity_worker,
+            initargs=(seqs_spec, sim_spec, alphabet),
+        ) as pool:
+            for _ in pool.imap_unordered(similarity_rows_task, blocks):
+                pass
+        sim = shared_sim if out is not None else shared_sim.copy()
+    finally:
+        del shared_seqs, shared_sim
+        owned = [seqs_shm] if out is not None else [seqs_shm, sim_shm]
+        for shm in owned:
+            shm.close()
+            shm.unlink()
+
+    return sim
+
+
+def benchmark_similarity_scaling(lseq, nb_jobs_list=(1, 2, 4, 8)):
+    """Strong-scaling benchmark: times `sequence_similarity_mat_parallel`
+    on the same <lseq> for each number of processes in <nb_jobs_list>, and
+    prints the speedup and parallel efficiency relative to the serial
+    `sequence_similarity_mat_onehot`.
+
+    Returns a dictionary {number of processes: time in seconds}.
+    """
+    start = time.perf_counter()
+    reference = sequence_similarity_mat_onehot(lseq)
+    serial_time = time.perf_counter() - start
+    print("serial      : {:.3f}s".format(serial_time))
+
+    times = {}
+    for nb_jobs in nb_jobs_list:
+        start = time.perf_counter()
+        sim = sequence_similarity_mat_parallel(lseq, nb_jobs)
+        times[nb_jobs] = time.perf_counter() - start
+        if not np.allclose(sim, reference):
+            print("Warning: results differ from the serial implementation")
+        speedup = serial_time / times[nb_jobs]
+        print(
+            "{:2d} processes: {:.3f}s speedup x{:.2f} efficiency {:.0%}".format(
+                nb_jobs, times[nb_jobs], speedup, speedup / nb_jobs
+            )
+        )
+    return times
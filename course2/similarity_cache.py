@@ -0,0 +1,218 @@
+"""Incremental computation of the similarity matrix, with an on-disk cache.
+
+When `main_script` is run again on a FASTA file where only a few sequences
+changed, most pairs of sequences were already compared in the previous
+run. Here the similarity of each pair is stored in a SQLite database,
+keyed by a hash of the content of the two sequences (so renamed or
+reordered sequences are still found), and only the pairs involving new
+or modified sequences are computed.
+"""
+
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from fasta import read_fasta
+from sequence_similarity import encode_sequences, one_hot_encode
+
+# Number of pairs read from the database at once: bounds the number of
+# python objects created while reading the cache.
+FETCH_PAIRS = 2**16
+
+
+def sequence_hash(seq):
+    """Hash (16 bytes) of the content of a sequence (`str` or `bytes`)."""
+    if isinstance(seq, str):
+        seq = seq.encode("ascii")
+    return hashlib.blake2b(seq, digest_size=16).digest()
+
+
+class SimilarityCache:
+    """Similarity of pairs of sequences, stored in a SQLite database.
+
+    Pairs are keyed by the hashes of the two sequences (see
+    `sequence_hash`), the smallest hash first.
+
+    Example:
+        with SimilarityCache("similarity_cache.sqlite") as cache:
+            sim = incremental_similarity_mat(lseq, cache)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pairs ("
+            "hash_a BLOB, hash_b BLOB, similarity REAL, "
+            "PRIMARY KEY (hash_a, hash_b)) WITHOUT ROWID"
+        )
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM pairs").fetchone()[0]
+
+    def known_pairs(self, hashes, chunk_size=FETCH_PAIRS):
+        """Finds the cached pairs between sequences with the given (unique)
+        <hashes>.
+
+        Yields (rows, cols, similarities) arrays of at most <chunk_size>
+        pairs, rows and cols being indexes in <hashes>.
+        """
+        self.connection.execute("DROP TABLE IF EXISTS temp.current")
+        self.connection.execute(
+            "CREATE TEMP TABLE current (hash BLOB PRIMARY KEY, idx INTEGER)"
+        )
+        self.connection.executemany(
+            "INSERT INTO current VALUES (?, ?)", zip(hashes, range(len(hashes)))
+        )
+        cursor = self.connection.execute(
+            "SELECT a.idx, b.idx, p.similarity FROM pairs AS p "
+            "JOIN current AS a ON p.hash_a = a.hash "
+            "JOIN current AS b ON p.hash_b = b.hash"
+        )
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            chunk = np.array(chunk, dtype=np.float64)
+            yield chunk[:, 0].astype(np.intp), chunk[:, 1].astype(np.intp), chunk[:, 2]
+        self.connection.execute("DROP TABLE temp.current")
+
+    def add_pairs(self, pairs):
+        """Stores an iterable (e.g. a generator) of (hash, hash, similarity)
+        tuples.
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO pairs VALUES (?, ?, ?)",
+            ((min(a, b), max(a, b), float(s)) for a, b, s in pairs),
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def incremental_similarity_mat(lseq, cache, block_size=256, stats=None):
+    """Compute similarity between all sequence pairs of <lseq> (which must
+    have the same length), reusing the pairs stored in <cache> (a
+    `SimilarityCache`) and storing the new ones in it.
+
+    Only the missing pairs are computed: the rows of sequences missing
+    most of their pairs with one-hot matrix products (by blocks of
+    <block_size> rows), the other pairs one by one. Identical sequences are
+    only computed once.
+
+    <stats>: optional dictionary, filled with the number of pairs found in
+             the cache ("hits") and computed ("misses"), and the number of
+             rows computed with matrix products ("computed rows").
+    """
+    seqs = encode_sequences(lseq)
+    n = len(seqs)
+    if n == 0:
+        return np.zeros((0, 0))
+    length = seqs.shape[1]
+
+    hashes = [sequence_hash(s.tobytes()) for s in seqs]
+    unique_hashes, first, inverse = np.unique(
+        np.array(hashes, dtype=object), return_index=True, return_inverse=True
+    )
+    unique_hashes = list(unique_hashes)
+    nb_unique = len(unique_hashes)
+
+    # 1. pairs already in the cache.
+    sim = np.zeros((nb_unique, nb_unique))
+    known = np.eye(nb_unique, dtype=bool)
+    np.fill_diagonal(sim, 1.0)
+    nb_hits = 0
+    for rows, cols, similarities in cache.known_pairs(unique_hashes):
+        sim[rows, cols] = sim[cols, rows] = similarities
+        known[rows, cols] = known[cols, rows] = True
+        nb_hits += len(rows)
+
+    # 2. missing pairs. The rows of the sequences missing most of their
+    # pairs (typically, new sequences) are computed entirely with one-hot
+    # matrix products, the other missing pairs one by one.
+    missing = ~known
+    missing_rows = np.flatnonzero(missing.sum(axis=1) > nb_unique // 2)
+    unique_seqs = seqs[first]
+    if len(missing_rows) > 0:
+        onehot, _ = one_hot_encode(unique_seqs)
+    for start in range(0, len(missing_rows), block_size):
+        block = missing_rows[start : start + block_size]
+        block_sim = (onehot[block] @ onehot.T) / length
+        sim[block] = block_sim
+        sim[:, block] = block_sim.T
+        missing[block] = missing[:, block] = False
+
+    i, j = np.nonzero(np.triu(missing, 1))
+    for start in range(0, len(i), 4096):
+        a, b = i[start : start + 4096], j[start : start + 4096]
+        sim[a, b] = sim[b, a] = (unique_seqs[a] == unique_seqs[b]).mean(axis=1)
+
+    # new pairs: all the pairs that were not known, generated row by row.
+    def new_pairs():
+        for a in range(nb_unique):
+            cols = np.flatnonzero(~known[a, a + 1 :]) + a + 1
+            for b, s in zip(cols, sim[a, cols]):
+                yield unique_hashes[a], unique_hashes[b], s
+
+    cache.add_pairs(new_pairs())
+
+    if stats is not None:
+        stats["hits"] = nb_hits
+        stats["misses"] = int(np.count_nonzero(~known)) // 2
+        stats["computed rows"] = len(missing_rows)
+
+    # 3. matrix of all the sequences (identical sequences share a row).
+    inverse = inverse.ravel()
+    return sim[np.ix_(inverse, inverse)]
+
+
+def main_script(input_filename, output_filename, cache_filename, verbose=True):
+    """Same as the `main_script` of the profiling notebook (the sequences
+    are sorted by GC% and the similarity matrix is written as a CSV file),
+    but the similarities are computed with `incremental_similarity_mat`
+    and cached in <cache_filename> between runs.
+
+    Returns the statistics of the cache (see `incremental_similarity_mat`).
+    """
+    # Step 1: read fasta
+    Dseq = read_fasta(input_filename)
+
+    # Step 2: compute GC%
+    Dgc = {k: 100 * (s.count("G") + s.count("C")) / len(s) for k, s in Dseq.items()}
+
+    # Step 3: sort by GC%.
+    ordered_seq = sorted(Dgc.keys(), key=lambda x: Dgc[x])
+
+    # Step 4: compute pairwise distance matrix, reusing the cached pairs.
+    stats = {}
+    with SimilarityCache(cache_filename) as cache:
+        sim = incremental_similarity_mat(
+            [Dseq[name] for name in ordered_seq], cache, stats=stats
+        )
+
+    # Step 5: write the matrix.
+    with open(output_filename, "w") as OUT:
+        print(",".join(ordered_seq), file=OUT)
+        for i in range(len(ordered_seq)):
+            print(*(sim[i]), sep=",", file=OUT)
+
+    if verbose:
+        total = stats["hits"] + stats["misses"]
+        print(
+            "similarity cache: {} hits, {} misses ({:.1%} hit rate), "
+            "{} rows computed".format(
+                stats["hits"],
+                stats["misses"],
+                stats["hits"] / total if total else 1.0,
+                stats["computed rows"],
+            )
+        )
+    return stats
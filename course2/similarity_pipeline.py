@@ -0,0 +1,171 @@
+"""Out-of-core version of the `main_script` of the profiling notebook.
+
+`main_script` keeps the whole similarity matrix in memory, which limits it
+to about 65,000 sequences with 32 GB of RAM. Here the matrix is computed
+by square blocks and written to a memory-mapped `.npy` file, so only a
+few blocks are in memory at any time. Progress is recorded after each
+block: if the computation is interrupted, running it again on the same
+sequences with the same arguments only computes the missing blocks.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from fasta import IndexedFasta
+from sequence_similarity import as_bytes, one_hot_encode, sequence_alphabet
+
+
+def sequences_digest(lseq, alphabet):
+    """Hash (hexadecimal blake2b) of the content and order of the sequences
+    of <lseq> (which must have the same length) and of their <alphabet>,
+    used to detect that a progress file was written for other sequences.
+    """
+    digest = hashlib.blake2b(alphabet.tobytes(), digest_size=16)
+    for s in lseq:
+        digest.update(as_bytes(s).tobytes())
+    return digest.hexdigest()
+
+
+def read_progress(progress_filename, header):
+    """Returns the set of (row block, column block) already written, as
+    recorded in <progress_filename>, or None if the file does not exist or
+    was written for another computation (different <header>).
+    """
+    if not os.path.exists(progress_filename):
+        return None
+    with open(progress_filename, "r") as IN:
+        if IN.readline().rstrip("\n") != header:
+            return None
+        done = set()
+        for l in IN:
+            fields = l.split()
+            if len(fields) == 2:  # ignores a line truncated by a crash
+                done.add((int(fields[0]), int(fields[1])))
+    return done
+
+
+def write_similarity_matrix(
+    lseq, output_filename, block_size=2048, dtype=np.float32, verbose=False
+):
+    """Computes the similarity between all pairs of sequences of <lseq>
+    (which must all have the same length) and writes it to <output_filename>,
+    a `.npy` file.
+
+    The matrix is computed by blocks of <block_size> x <block_size>
+    sequences, with one-hot matrix products (see
+    `sequence_similarity.sequence_similarity_mat_onehot`). Only the blocks
+    of the upper triangle are computed, each one being written at its
+    position and at its transposed position.
+
+    Each finished block is recorded in <output_filename>.progress, after
+    the block has been flushed to disk. If that file exists and matches
+    the current arguments and sequences (see `sequences_digest`), the
+    blocks it lists are skipped, which makes the computation resumable;
+    otherwise the matrix is computed from scratch.
+
+    Returns the matrix, as a read-only memory-mapped array.
+    """
+    n = len(lseq)
+    length = len(lseq[0]) if n > 0 else 1
+    if any(len(s) != length for s in lseq):
+        raise ValueError("all sequences must have the same length")
+    alphabet = sequence_alphabet(lseq)
+    # float32 counts are exact up to 2**24.
+    product_dtype = np.float32 if length <= 2**24 else np.float64
+
+    nb_blocks = -(-n // block_size)
+    progress_filename = output_filename + ".progress"
+    header = "n={} length={} block_size={} dtype={} digest={}".format(
+        n, length, block_size, np.dtype(dtype), sequences_digest(lseq, alphabet)
+    )
+
+    done = read_progress(progress_filename, header)
+    if done is not None and os.path.exists(output_filename):
+        sim = np.lib.format.open_memmap(output_filename, mode="r+")
+        if sim.shape != (n, n) or sim.dtype != dtype:
+            done = None
+    else:
+        done = None
+
+    if done is None:
+        sim = np.lib.format.open_memmap(
+            output_filename, mode="w+", dtype=dtype, shape=(n, n)
+        )
+        with open(progress_filename, "w") as OUT:
+            print(header, file=OUT)
+        done = set()
+
+    with open(progress_filename, "a") as PROGRESS:
+        for bi in range(nb_blocks):
+            rows = slice(bi * block_size, min((bi + 1) * block_size, n))
+            row_onehot = None
+
+            for bj in range(bi, nb_blocks):
+                if (bi, bj) in done:
+                    continue
+                if row_onehot is None:
+                    row_onehot, _ = one_hot_encode(
+                        lseq[rows], dtype=product_dtype, alphabet=alphabet
+                    )
+                cols = slice(bj * block_size, min((bj + 1) * block_size, n))
+                col_onehot, _ = one_hot_encode(
+                    lseq[cols], dtype=product_dtype, alphabet=alphabet
+                )
+
+                block = (row_onehot @ col_onehot.T) / length
+                sim[rows, cols] = block
+                sim[cols, rows] = block.T
+                sim.flush()
+
+                print(bi, bj, file=PROGRESS, flush=True)
+                os.fsync(PROGRESS.fileno())
+                done.add((bi, bj))
+                if verbose:
+                    print(
+                        "block {},{} done ({}/{})".format(
+                            bi, bj, len(done), nb_blocks * (nb_blocks + 1) // 2
+                        )
+                    )
+
+    del sim
+    return np.load(output_filename, mmap_mode="r")
+
+
+def main_script(input_filename, output_filename, block_size=2048):
+    """Same steps as the `main_script` of the profiling notebook, without
+    holding the similarity matrix in memory:
+
+    1. the FASTA file is read through its index (`fasta.IndexedFasta`).
+    2. the GC% of each sequence is computed.
+    3. the sequences are sorted by GC%.
+    4. the similarity matrix is computed and written by blocks to
+       <output_filename> (a `.npy` file, see `write_similarity_matrix`).
+    5. the names of the sequences, in the order of the matrix rows, are
+       written to <output_filename>.names, one per line.
+
+    Returns the matrix, as a read-only memory-mapped array.
+    """
+    # Step 1: index the fasta file.
+    with IndexedFasta(input_filename) as fasta:
+
+        # Step 2: compute GC%.
+        Dgc = {}
+        for name, seq in fasta.items():
+            Dgc[name] = 100 * (seq.count(b"G") + seq.count(b"C")) / len(seq)
+
+        # Step 3: sort by GC%.
+        ordered_seq = sorted(Dgc.keys(), key=lambda x: Dgc[x])
+
+        # Step 4: compute and write the pairwise similarity matrix.
+        # Only the sequences (n * L bytes) are loaded, not the n * n matrix.
+        lseq = [fasta[name] for name in ordered_seq]
+
+    sim = write_similarity_matrix(lseq, output_filename, block_size=block_size)
+
+    # Step 5: write the sequence names.
+    with open(output_filename + ".names", "w") as OUT:
+        print(*ordered_seq, sep="\n", file=OUT)
+
+    return sim
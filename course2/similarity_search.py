@@ -0,0 +1,313 @@
+"""Search of the pairs of sequences above a similarity threshold.
+
+When only the pairs of similar sequences are needed, computing the whole
+similarity matrix is wasteful. `similarity_search` skips most of the work
+for pairs which cannot reach the threshold:
+
+1. pre-filter: two sequences cannot have more identical positions than
+   sum over characters c of min(count of c in seqA, count of c in seqB).
+   This bound is computed from the composition of the sequences, for all
+   pairs at once, and pairs below the threshold are discarded.
+2. early termination: the remaining pairs are compared by blocks of
+   positions (on the 2-bit packed sequences, see
+   `sequence_similarity.PackedSequences`), and a pair is abandoned as soon
+   as its number of mismatches is too high for the threshold to be reached.
+
+Both stages are computed for blocks of rows at once. At low thresholds,
+where they cannot discard enough pairs, the blocks are computed with
+one-hot matrix products instead (see `similarity_search`).
+"""
+
+import numpy as np
+
+from sequence_composition import count_bytes
+from sequence_similarity import (
+    BASES_PER_WORD,
+    LOW_BITS,
+    PackedSequences,
+    encode_sequences,
+    one_hot_encode,
+    popcount,
+    sequence_alphabet,
+)
+
+# Maximum number of pairs handled at once: bounds the size of the
+# temporary arrays (a few int64 or uint64 per pair and packed word).
+MAX_BLOCK_PAIRS = 2**18
+
+# Fraction of the pairs of a block still alive after the first positions
+# above which the block is computed with a one-hot matrix product: early
+# termination would then save too little to beat it.
+DENSE_FRACTION = 0.25
+
+
+def unrelated_mismatch_rate(counts):
+    """Probability that two positions drawn at random in the sequences
+    differ, from the (number of sequences x number of characters) counts
+    of their characters: 1 - sum over characters of their frequency**2
+    (3/4 for uniform random nucleotides).
+
+    >>> float(unrelated_mismatch_rate(np.array([[1, 1, 1, 1], [2, 2, 2, 2]])))
+    0.75
+    """
+    frequencies = counts.sum(axis=0) / counts.sum()
+    return 1 - (frequencies**2).sum()
+
+
+def similarity_search(lseq, threshold, block_size=256, stats=None):
+    """Finds all pairs of sequences (i < j) of <lseq> whose similarity (see
+    `sequence_similarity.compute_sequence_similarity`) is at least
+    <threshold>. All sequences must have the same length.
+
+    The pairs are processed by blocks of rows holding about
+    MAX_BLOCK_PAIRS pairs: the pre-filter and the comparison of the first
+    <block_size> positions are computed for all the pairs of a block at
+    once, then only the remaining pairs are compared.
+
+    Early termination only pays off when most pairs can be abandoned after
+    a few positions, i.e. at high thresholds: unrelated sequences differ at
+    about 3/4 of the positions (see `unrelated_mismatch_rate`), so a pair
+    can only be abandoned after about 4/3 * (1 - threshold) * length
+    positions. The search switches to one-hot matrix products (as
+    `sequence_similarity.sequence_similarity_mat_onehot`):
+    - for all the pairs, when unrelated pairs are not expected to be
+      abandoned after the first <block_size> positions (e.g. below a
+      threshold of about 0.8 for 1000 bases);
+    - for a block of rows, when more than DENSE_FRACTION of its pairs are
+      still alive after the first <block_size> positions (most sequences
+      are related).
+    Below the crossover, the search therefore costs about as much as the
+    whole matrix plus the selection of the pairs; above it, it is faster,
+    and its cost decreases as the threshold increases.
+
+    <block_size>: number of positions compared at once, between two checks
+                  of the number of mismatches (rounded to a multiple of 32).
+    <stats>: optional dictionary, filled with the number of pairs discarded
+             by the pre-filter ("prefiltered"), abandoned during the
+             comparison ("terminated"), computed with matrix products
+             ("dense") and found ("hits").
+
+    Returns (rows, cols, similarities) arrays, sorted by rows then cols
+    (see `to_sparse_matrix` to get a scipy sparse matrix).
+
+    >>> rows, cols, sims = similarity_search(["AAAGC", "ATAGG", "TTACC"], 0.5)
+    >>> rows, cols, sims
+    (array([0]), array([1]), array([0.6]))
+    """
+    seqs = encode_sequences(lseq)
+    n = len(seqs)
+    length = seqs.shape[1] if n > 0 else 0
+    if length == 0 or n < 2:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, np.zeros(0)
+
+    # minimum number of identical positions, and maximum of mismatches.
+    needed = int(np.ceil(threshold * length - 1e-9))
+    max_mismatches = length - needed
+
+    alphabet = sequence_alphabet(seqs)
+    counts = count_bytes(seqs.ravel(), np.arange(n + 1) * length)[:, alphabet]
+
+    packed = PackedSequences(seqs)
+    words = packed.words
+    first_words = slice(0, max(1, block_size // BASES_PER_WORD))
+    rows_per_block = max(1, MAX_BLOCK_PAIRS // n)
+    onehot = None
+    # expected mismatches of unrelated pairs over the first positions.
+    first_positions = min(length, first_words.stop * BASES_PER_WORD)
+    dense = (
+        first_words.stop < words.shape[1]
+        and max_mismatches >= unrelated_mismatch_rate(counts) * first_positions
+    )
+
+    results = []
+    counters = {"prefiltered": 0, "terminated": 0, "dense": 0}
+    for start in range(0, n - 1, rows_per_block):
+        stop = min(start + rows_per_block, n - 1)
+        block_rows, block_cols = slice(start, stop), slice(start + 1, n)
+
+        candidates = np.arange(start + 1, n) > np.arange(start, stop)[:, np.newaxis]
+        nb_candidates = int(np.count_nonzero(candidates))
+
+        block_dense = dense
+        if not dense:
+            # 1. pre-filter on composition, for all the pairs (i, j > i) of
+            # the rows start:stop at once.
+            bound = np.minimum(
+                counts[block_rows, np.newaxis, :], counts[np.newaxis, block_cols, :]
+            ).sum(axis=2)
+            candidates &= bound >= needed
+            nb_pairs = nb_candidates
+            nb_candidates = int(np.count_nonzero(candidates))
+            counters["prefiltered"] += nb_pairs - nb_candidates
+
+            # 2. first positions of all the pairs at once.
+            mismatches, shared_ambiguous = block_packed_mismatches(
+                packed, block_rows, block_cols, first_words
+            )
+            alive = candidates & (mismatches - shared_ambiguous <= max_mismatches)
+            nb_alive = int(np.count_nonzero(alive))
+            block_dense = nb_alive > DENSE_FRACTION * max(1, nb_candidates)
+
+        if block_dense and first_words.stop < words.shape[1]:
+            # 3a. most pairs may reach the threshold: matrix product.
+            if onehot is None:
+                onehot, _ = one_hot_encode(seqs, alphabet=alphabet)
+            counters["dense"] += nb_candidates
+            same = np.rint(onehot[block_rows] @ onehot[block_cols].T)
+            rows, cols = np.nonzero(candidates & (same >= needed))
+            identities = same[rows, cols]
+            counters["terminated"] += nb_candidates - len(rows)
+            rows, cols = rows + start, cols + start + 1
+        else:
+            # 3b. comparison of the remaining positions of the remaining
+            # pairs, with early termination.
+            counters["terminated"] += nb_candidates - nb_alive
+            rows, cols = np.nonzero(alive)
+            mismatches, rows, cols = compare_packed_pairs(
+                packed,
+                rows + start,
+                cols + start + 1,
+                mismatches[rows, cols],
+                shared_ambiguous[rows, cols],
+                first_words.stop,
+                first_words.stop,
+                max_mismatches,
+                counters,
+            )
+            identities = length - mismatches
+        results.append((rows, cols, identities))
+
+    rows, cols, identities = (np.concatenate(r) for r in zip(*results))
+    if stats is not None:
+        stats.update(counters)
+        stats["hits"] = len(rows)
+    return rows.astype(np.intp), cols.astype(np.intp), identities / length
+
+
+def block_packed_mismatches(packed, rows, cols, words):
+    """Mismatches between all the pairs of sequences <rows> x <cols> (two
+    slices) of a `PackedSequences`, over the packed <words> (a slice), see
+    `count_packed_mismatches`. The ambiguous positions are only handled
+    for the sequences which have some.
+
+    Returns (mismatches, shared ambiguous positions) arrays of shape
+    (number of rows, number of cols).
+    """
+    w = packed.words
+    mismatches, shared_ambiguous = count_packed_mismatches(
+        w[rows, np.newaxis, words], w[np.newaxis, cols, words]
+    )
+    mask = packed.ambiguous_mask
+    if mask is None:
+        return mismatches, shared_ambiguous
+
+    ambiguous_rows = np.flatnonzero(packed.nb_ambiguous[rows])
+    if len(ambiguous_rows) > 0:
+        ambiguous = ambiguous_rows + rows.start
+        mismatches[ambiguous_rows], shared_ambiguous[ambiguous_rows] = (
+            count_packed_mismatches(
+                w[ambiguous, np.newaxis, words],
+                w[np.newaxis, cols, words],
+                mask[ambiguous, np.newaxis, words],
+                mask[np.newaxis, cols, words],
+            )
+        )
+    ambiguous_cols = np.flatnonzero(packed.nb_ambiguous[cols])
+    if len(ambiguous_cols) > 0:
+        ambiguous = ambiguous_cols + cols.start
+        mismatches[:, ambiguous_cols], shared_ambiguous[:, ambiguous_cols] = (
+            count_packed_mismatches(
+                w[rows, np.newaxis, words],
+                w[np.newaxis, ambiguous, words],
+                mask[rows, np.newaxis, words],
+                mask[np.newaxis, ambiguous, words],
+            )
+        )
+    return mismatches, shared_ambiguous
+
+
+def count_packed_mismatches(words_a, words_b, mask_a=None, mask_b=None):
+    """Number of mismatches between 2-bit packed words <words_a> and
+    <words_b> (broadcast together), summed over the last axis, and number
+    of positions ambiguous in both (see `PackedSequences`). Ambiguous
+    positions are counted as mismatches.
+
+    Returns (mismatches, shared ambiguous positions) int64 arrays.
+    """
+    diff = words_a ^ words_b
+    if mask_a is None:
+        shared_ambiguous = np.zeros(diff.shape[:-1], dtype=np.int64)
+    else:
+        diff |= mask_a | mask_b
+        both = mask_a & mask_b & LOW_BITS
+        shared_ambiguous = popcount(both).sum(axis=-1, dtype=np.int64)
+    mismatch_bits = (diff | (diff >> np.uint64(1))) & LOW_BITS
+    return popcount(mismatch_bits).sum(axis=-1, dtype=np.int64), shared_ambiguous
+
+
+def compare_packed_pairs(
+    packed,
+    rows,
+    cols,
+    mismatches,
+    shared_ambiguous,
+    first_word,
+    block_words,
+    max_mismatches,
+    counters,
+):
+    """Counts the mismatches of the pairs (rows[p], cols[p]) of a
+    `PackedSequences`, from word <first_word> on (<mismatches> and
+    <shared_ambiguous> hold the counts of the previous words), by blocks of
+    <block_words> words, abandoning a pair as soon as its number of
+    mismatches is above <max_mismatches>. Abandoned pairs are counted in
+    counters["terminated"].
+
+    Ambiguous positions are counted as mismatches by the XOR, so the
+    positions ambiguous in both sequences (which may be identical) are
+    subtracted to get a lower bound, and the pairs with such positions are
+    recounted exactly at the end.
+
+    Returns (mismatches, rows, cols) of the pairs below <max_mismatches>.
+    """
+    words = packed.words
+    mask = packed.ambiguous_mask
+    for start in range(first_word, words.shape[1], block_words):
+        if len(rows) == 0:
+            break
+        block = slice(start, start + block_words)
+        block_mismatches, block_shared = count_packed_mismatches(
+            words[rows, block],
+            words[cols, block],
+            None if mask is None else mask[rows, block],
+            None if mask is None else mask[cols, block],
+        )
+        mismatches = mismatches + block_mismatches
+        shared_ambiguous = shared_ambiguous + block_shared
+        keep = mismatches - shared_ambiguous <= max_mismatches
+        counters["terminated"] += len(rows) - int(np.count_nonzero(keep))
+        rows, cols = rows[keep], cols[keep]
+        mismatches = mismatches[keep]
+        shared_ambiguous = shared_ambiguous[keep]
+
+    # exact count for the pairs with shared ambiguous positions.
+    uncertain = np.flatnonzero(shared_ambiguous)
+    for i in np.unique(rows[uncertain]):
+        pairs = uncertain[rows[uncertain] == i]
+        mismatches[pairs] = packed.lengths[i] - packed.count_identities(i, cols[pairs])
+    keep = mismatches <= max_mismatches
+    counters["terminated"] += len(rows) - int(np.count_nonzero(keep))
+    return mismatches[keep], rows[keep], cols[keep]
+
+
+def to_sparse_matrix(n, rows, cols, similarities, symmetric=True):
+    """Returns the pairs found by `similarity_search` as a <n> x <n>
+    scipy.sparse COO matrix, with both (i, j) and (j, i) if <symmetric>.
+    """
+    from scipy import sparse  # only needed for this function.
+
+    if symmetric:
+        rows, cols = np.concatenate((rows, cols)), np.concatenate((cols, rows))
+        similarities = np.concatenate((similarities, similarities))
+    return sparse.coo_matrix((similarities, (rows, cols)), shape=(n, n))
@@ -0,0 +1,168 @@
+"""Batched dispatch of index ranges to a process pool.
+
+Mapping a function on one tiny task per item (e.g. `pool.map` on the list
+of the n**2 (i, j) pairs built by `pairwise_list_I` in the multiprocessing
+notebook) makes the cost of sending each task to a worker, and its result
+back, much larger than the computation itself. Here the work is described
+as (start, stop) ranges of item indexes, generated lazily, and each task
+processes a whole range. The size of the ranges is chosen from the
+measured cost of a first task, and the time spent computing is compared
+to the time spent dispatching (see `print_dispatch_report`).
+"""
+
+import math
+import multiprocessing as mp
+import time
+
+# Maximum fraction of the time of a task spent dispatching it (sending it
+# to a worker and getting its result back), used to choose the batch size.
+MAX_DISPATCH_FRACTION = 0.05
+
+# Number of items of the first task, used to measure the cost of an item.
+PROBE_ITEMS = 16
+
+
+def index_ranges(start, stop, batch_size):
+    """Yields the (start, stop) ranges of <batch_size> consecutive indexes
+    (the last one may be shorter) between <start> and <stop>.
+
+    >>> list(index_ranges(0, 10, 4))
+    [(0, 4), (4, 8), (8, 10)]
+    """
+    for first in range(start, stop, batch_size):
+        yield first, min(first + batch_size, stop)
+
+
+def timed_task(task):
+    """Runs func(start, stop) for a (func, start, stop) <task>.
+
+    Returns (start, stop, result, computation time in seconds).
+    """
+    func, start, stop = task
+    begin = time.perf_counter()
+    result = func(start, stop)
+    return start, stop, result, time.perf_counter() - begin
+
+
+def choose_batch_size(
+    n,
+    item_cost,
+    dispatch_cost,
+    nb_jobs,
+    max_batch_size=None,
+    max_dispatch_fraction=MAX_DISPATCH_FRACTION,
+):
+    """Number of items per task, for <n> items costing <item_cost> seconds
+    each and a dispatch cost of <dispatch_cost> seconds per task: the
+    smallest batch whose dispatch costs at most <max_dispatch_fraction> of
+    its computation, but with at least 4 tasks per process (for load
+    balancing) and at most <max_batch_size> items (to bound the memory used
+    by a task).
+
+    >>> choose_batch_size(10000, 1e-3, 1e-4, 2)
+    2
+    >>> choose_batch_size(10000, 1e-6, 1e-4, 2)
+    1250
+    """
+    batch_size = math.ceil(
+        dispatch_cost / (max_dispatch_fraction * max(item_cost, 1e-9))
+    )
+    batch_size = min(batch_size, math.ceil(n / (4 * nb_jobs)))
+    if max_batch_size is not None:
+        batch_size = min(batch_size, max_batch_size)
+    return max(1, batch_size)
+
+
+def run_batched(
+    func,
+    n,
+    nb_jobs=None,
+    batch_size=None,
+    max_batch_size=None,
+    initializer=None,
+    initargs=(),
+    start_method=None,
+    report=None,
+):
+    """Computes func(start, stop) on ranges of indexes covering range(n),
+    with a pool of <nb_jobs> processes (by default, one per CPU).
+
+    <func> must be a module-level function (it is sent to the workers by
+    reference), and must accept an empty range. The ranges are generated
+    lazily, so no list of the <n> indexes is built.
+
+    <batch_size>: number of items per task. By default, a first task of
+                  PROBE_ITEMS items measures the cost of an item and of the
+                  dispatch of a task, and the batch size is chosen with
+                  `choose_batch_size` (limited to <max_batch_size>).
+    <initializer>, <initargs>, <start_method>: passed to the pool (see
+                  `multiprocessing.get_context`).
+    <report>: optional dictionary, filled with the number of "tasks", the
+              "batch size", the measured "item cost" and "dispatch cost"
+              (None if <batch_size> is given), and the "startup" time of
+              the pool, "wall" time, total "compute" time in the workers,
+              "overhead" (processes x wall time - compute time) and
+              "efficiency" (compute time / (processes x wall time)).
+
+    Returns the list of the results of <func>, in the order of the ranges.
+    """
+    if nb_jobs is None:
+        nb_jobs = mp.cpu_count()
+    context = mp.get_context(start_method)
+
+    item_cost = dispatch_cost = None
+    results = []
+    wall_start = time.perf_counter()
+    with context.Pool(nb_jobs, initializer=initializer, initargs=initargs) as pool:
+        # empty task: waits for a worker to be ready.
+        pool.apply(timed_task, ((func, 0, 0),))
+        startup = time.perf_counter() - wall_start
+
+        first = 0
+        if batch_size is None:
+            first = min(n, PROBE_ITEMS)
+            begin = time.perf_counter()
+            probe = pool.apply(timed_task, ((func, 0, first),))
+            round_trip = time.perf_counter() - begin
+            results.append(probe)
+            item_cost = probe[3] / max(1, first)
+            dispatch_cost = max(0.0, round_trip - probe[3])
+            batch_size = choose_batch_size(
+                n - first, item_cost, dispatch_cost, nb_jobs, max_batch_size
+            )
+
+        tasks = ((func, a, b) for a, b in index_ranges(first, n, batch_size))
+        results.extend(pool.imap_unordered(timed_task, tasks))
+    wall = time.perf_counter() - wall_start
+
+    if report is not None:
+        compute = sum(r[3] for r in results)
+        report["tasks"] = len(results)
+        report["batch size"] = batch_size
+        report["item cost"] = item_cost
+        report["dispatch cost"] = dispatch_cost
+        report["startup"] = startup
+        report["wall"] = wall
+        report["compute"] = compute
+        report["overhead"] = nb_jobs * wall - compute
+        report["efficiency"] = compute / (nb_jobs * wall) if wall > 0 else 1.0
+
+    results.sort(key=lambda r: r[0])
+    return [r[2] for r in results]
+
+
+def print_dispatch_report(report, label=""):
+    """Prints a report filled by `run_batched` on one line."""
+    print(
+        "{}{} tasks of {} items: wall {:.3f}s (startup {:.3f}s), "
+        "compute {:.3f}s, overhead {:.3f}s, efficiency {:.0%}".format(
+            label,
+            report["tasks"],
+            report["batch size"],
+            report["wall"],
+            report["startup"],
+            report["compute"],
+            report["overhead"],
+            report["efficiency"],
+        )
+    )
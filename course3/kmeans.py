@@ -1,7 +1,25 @@
+import multiprocessing as mp
+import time
+import timeit
+import warnings
+from multiprocessing import shared_memory
+
 import numpy as np
 
+try:
+    from numba import get_num_threads, njit, prange
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 np.seterr(divide="ignore", invalid="ignore")
 
+# Memory budget (in bytes) for the block of distances and points handled at
+# once by computeNearestCentroidBatched. 1 MiB keeps a chunk in the L2 cache
+# of most CPUs while still being large enough for BLAS to be efficient.
+CHUNK_BYTES = 2**20
+
 
 def computeDistanceToCentroid(points, centroid):
     """Computes the squared euclidean distance between a set
@@ -49,6 +67,196 @@ def computeNearestCentroid(points, centroids):
     return closestCentroid
 
 
+def computePointNorms(points):
+    """computes the squared euclidean norm of each point in <points>
+    * points: a 'number of dimensions'*n array.
+
+    The norms are returned as a 1D array of n values. They do not depend on
+    the centroids, so they can be computed once and reused at every round.
+    doctest strings:
+    >>> p = np.array([[ 0,  0, 1, 1],[ 0,  1, 0, 1]])
+    >>> computePointNorms(p)
+    array([0, 1, 1, 2])
+    """
+    return np.einsum("ij,ij->j", points, points)
+
+
+def computeChunkSize(nbDim, nbCentroids, chunkBytes=CHUNK_BYTES, itemSize=8):
+    """computes how many points can be processed at once so that the chunk of
+    points and its (nbCentroids * chunk) block of distances fit in <chunkBytes>,
+    with values of <itemSize> bytes (8 for float64, 4 for float32).
+
+    >>> computeChunkSize(20, 10)
+    4369
+    >>> computeChunkSize(20, 10, itemSize=4)
+    8738
+    >>> computeChunkSize(20, 10, chunkBytes=1)
+    1
+    """
+    return max(1, chunkBytes // (itemSize * (nbDim + nbCentroids)))
+
+
+def computeDtype(points, dtype=None):
+    """returns the floating point type used to compute distances on <points>:
+    <dtype> if given, float32 for float32 points, and float64 otherwise.
+
+    >>> computeDtype(np.zeros((2, 3), dtype=np.float32))
+    dtype('float32')
+    >>> computeDtype(np.zeros((2, 3), dtype=int))
+    dtype('float64')
+    """
+    if dtype is not None:
+        return np.dtype(dtype)
+    if points.dtype == np.float32:
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+def allocateRoundBuffers(nbPoints, k, chunkSize, dtype=np.float64, nbDim=None):
+    """preallocates the arrays used by computeNearestCentroidBatched, so that
+    they can be reused from one Kmeans round to the next instead of being
+    allocated at each round:
+    * "distances": room for one k*<chunkSize> block of distances.
+    * "assignment": the 1*n output assignment.
+    * "pointsChunk": if <nbDim> is given, room for one chunk of points
+                     converted to float64, used by computeClusterSums.
+    """
+    buffers = {
+        "distances": np.empty(k * chunkSize, dtype=dtype),
+        "assignment": np.empty(nbPoints, dtype=np.intp),
+    }
+    if nbDim is not None:
+        buffers["pointsChunk"] = np.empty(nbDim * chunkSize, dtype=np.float64)
+    return buffers
+
+
+def computeNearestCentroidBatched(
+    points,
+    centroids,
+    pointNorms=None,
+    chunkSize=None,
+    returnDistances=False,
+    dtype=None,
+    buffers=None,
+):
+    """computes the closest <centroid> for each point in <points>, computing
+    all point-to-centroid distances of a chunk of points in one matrix product.
+
+    Drop-in replacement for computeNearestCentroid, using the expansion
+    ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2
+
+    * points: a 'number of dimensions'*n array.
+    * centroids: a list of 1*'number of dimensions' arrays,
+                 or a k*'number of dimensions' array.
+    * pointNorms: optional, the output of computePointNorms(points).
+                  Only used when <returnDistances> is True.
+    * chunkSize: number of points processed at once. By default it is
+                 derived from CHUNK_BYTES so that memory stays bounded.
+    * returnDistances: if True, also returns the squared distance of each
+                       point to its closest centroid.
+    * dtype: floating point type of the distance computations (see
+             computeDtype). <points> is never converted as a whole : only
+             the current chunk is, if its type differs, so that large
+             (e.g. memory-mapped) arrays are not copied.
+    * buffers: optional, the output of allocateRoundBuffers. The returned
+               assignment is then written in buffers["assignment"], and the
+               distances in buffers["minDistances"] if it exists.
+
+    The closest are returned as a 1*n array that contains the index of the
+        closest centroid doctest strings:
+    >>> p = np.array([[ 0,  0, 1, 1],[ 0,  1, 0, 1]])
+    >>> c = [ np.array([ -0.5, 0.5]) , np.array([ 1.5, 0.5]) ]
+    >>> computeNearestCentroidBatched(p,c)
+    array([0, 0, 1, 1])
+    >>> computeNearestCentroidBatched(p, c, chunkSize=3, returnDistances=True)
+    (array([0, 0, 1, 1]), array([0.5, 0.5, 0.5, 0.5]))
+    """
+    nbDim, nbPoints = points.shape
+    dtype = computeDtype(points, dtype)
+    centroids = np.asarray(centroids, dtype=dtype)
+    centroidNorms = np.einsum("ij,ij->i", centroids, centroids)
+    k = len(centroids)
+
+    if chunkSize is None:
+        chunkSize = computeChunkSize(nbDim, k, itemSize=dtype.itemsize)
+
+    if buffers is None:
+        buffers = allocateRoundBuffers(nbPoints, k, chunkSize, dtype)
+    closestCentroid = buffers["assignment"]
+    distanceBuffer = buffers["distances"]
+
+    if returnDistances:
+        if pointNorms is None:
+            pointNorms = computePointNorms(points)
+        minDistances = buffers.get("minDistances")
+        if minDistances is None:
+            minDistances = np.empty(nbPoints, dtype=np.float64)
+
+    for start in range(0, nbPoints, chunkSize):
+        stop = min(start + chunkSize, nbPoints)
+
+        # 1. computing distances for the whole chunk, as a k*chunk block.
+        #    ||x||^2 is the same for all centroids, so it is not needed
+        #    to find the closest one.
+        chunk = points[:, start:stop]
+        if chunk.dtype != dtype:
+            chunk = chunk.astype(dtype)
+        distances = distanceBuffer[: k * (stop - start)].reshape(k, stop - start)
+        np.matmul(centroids, chunk, out=distances)
+        distances *= -2
+        distances += centroidNorms[:, np.newaxis]
+
+        # 2. finding the closest centroid for each point
+        np.argmin(distances, axis=0, out=closestCentroid[start:stop])
+
+        if returnDistances:
+            closest = distances[closestCentroid[start:stop], np.arange(stop - start)]
+            # clamping small negative values due to floating point cancellation
+            np.maximum(
+                closest + pointNorms[start:stop], 0, out=minDistances[start:stop]
+            )
+
+    if returnDistances:
+        return closestCentroid, minDistances
+    return closestCentroid
+
+
+def benchmarkNearestCentroid(points, centroids, nbRepeats=5):
+    """times computeNearestCentroid against computeNearestCentroidBatched
+    on the same <points> and <centroids>.
+
+    Returns a dictionary with the best time (in seconds) of each
+    implementation and the speedup factor.
+    """
+    pointNorms = computePointNorms(points)
+
+    if not np.array_equal(
+        computeNearestCentroid(points, centroids),
+        computeNearestCentroidBatched(points, centroids, pointNorms),
+    ):
+        print("Warning: the two implementations disagree (ties between centroids?)")
+
+    timeLoop = min(
+        timeit.repeat(
+            lambda: computeNearestCentroid(points, centroids),
+            number=1,
+            repeat=nbRepeats,
+        )
+    )
+    timeBatched = min(
+        timeit.repeat(
+            lambda: computeNearestCentroidBatched(points, centroids, pointNorms),
+            number=1,
+            repeat=nbRepeats,
+        )
+    )
+    print("computeNearestCentroid        : {:.4f}s".format(timeLoop))
+    print("computeNearestCentroidBatched : {:.4f}s".format(timeBatched))
+    print("Speedup factor: {:.2f}".format(timeLoop / timeBatched))
+
+    return {"loop": timeLoop, "batched": timeBatched, "speedup": timeLoop / timeBatched}
+
+
 def computeCentroids(points, assignments, k):
     """computes the centroids for <points> with a given <assignment>
     * points: a 'number of dimensions'*n array
@@ -80,61 +288,1296 @@ def computeCentroids(points, assignments, k):
     return centroids
 
 
-def KmeanRound(points, centroids):
+def computeCentroidsVectorized(
+    points, assignments, k, previousCentroids=None, buffer=None
+):
+    """computes the centroids for <points> with a given <assignment>, without
+    any per-point python loop: each dimension is summed per cluster with a
+    weighted np.bincount (see computeClusterSums, which also describes
+    <buffer>).
+
+    * points: a 'number of dimensions'*n array
+    * assignments: a 1*n array containing indexes from 0 to <k>
+    * previousCentroids: optional, k*'number of dimensions' array (or list of
+                         arrays). Clusters which receive no point keep their
+                         previous centroid. Without it, empty clusters are
+                         placed at the mean of all points.
+
+    Centroids are returned as a contiguous k*'number of dimensions' array
+    doctest strings:
+    >>> p = np.array([[ 0,  0, 1, 1],[ 0,  1, 0, 1]])
+    >>> a = np.array([0, 0, 1, 1])
+    >>> computeCentroidsVectorized( p , a , 2 )
+    array([[0. , 0.5],
+           [1. , 0.5]])
+    >>> computeCentroidsVectorized( p , a , 3 , previousCentroids=[[0, 0], [1, 1], [5, 5]] )
+    array([[0. , 0.5],
+           [1. , 0.5],
+           [5. , 5. ]])
+    """
+    clusterSums, clusterSize = computeClusterSums(points, assignments, k, buffer)
+    return computeCentroidsFromSums(clusterSums, clusterSize, previousCentroids)
+
+
+def computeClusterSums(points, assignments, k, buffer=None):
+    """computes, for each cluster, the sum of the coordinates of its points
+    and its number of points.
+
+    * points: a 'number of dimensions'*n array, possibly a np.memmap.
+    * assignments: a 1*n array containing indexes from 0 to <k>
+    * buffer: optional float64 array, reused to hold one chunk of points
+              converted to float64 (its size sets the number of points per
+              chunk). By default, a chunk of computeChunkSize points.
+
+    The points are processed by chunks, so that the temporary arrays do
+    not grow with n, and each chunk of a memory-mapped array is read once.
+
+    Returns a k*'number of dimensions' array of sums and a 1D array of k sizes
+    doctest strings:
+    >>> p = np.array([[ 0,  0, 1, 1],[ 0,  1, 0, 1]])
+    >>> computeClusterSums( p , np.array([0, 0, 1, 1]) , 3 )
+    (array([[0., 1.],
+           [2., 1.],
+           [0., 0.]]), array([2, 2, 0]))
+    """
+    nbDim, nbPoints = points.shape
+    if buffer is None:
+        chunkSize = min(max(1, nbPoints), computeChunkSize(nbDim, k))
+        buffer = np.empty(nbDim * chunkSize, dtype=np.float64)
+    chunkSize = max(1, len(buffer) // max(1, nbDim))
+
+    clusterSize = np.bincount(assignments, minlength=k)
+    clusterSums = np.zeros((k, nbDim), dtype=np.float64)
+
+    for start in range(0, nbPoints, chunkSize):
+        stop = min(start + chunkSize, nbPoints)
+        # the weights of np.bincount must be contiguous float64 : the chunk
+        # is converted once, in the buffer.
+        chunk = buffer[: nbDim * (stop - start)].reshape(nbDim, stop - start)
+        chunk[:] = points[:, start:stop]
+        chunkAssignments = assignments[start:stop]
+
+        # Summing all values, one dimension at a time.
+        for i in range(nbDim):
+            clusterSums[:, i] += np.bincount(
+                chunkAssignments, weights=chunk[i], minlength=k
+            )
+
+    return clusterSums, clusterSize
+
+
+def computeCentroidsFromSums(clusterSums, clusterSize, previousCentroids=None):
+    """computes the centroids from the output of computeClusterSums (possibly
+    summed over several subsets of the points).
+
+    Empty clusters keep their previous centroid if <previousCentroids> is
+    given, otherwise they are placed at the mean of all points.
+
+    >>> s = np.array([[0., 1.], [2., 1.], [0., 0.]])
+    >>> computeCentroidsFromSums( s , np.array([2, 2, 0]) )
+    array([[0. , 0.5],
+           [1. , 0.5],
+           [0.5, 0.5]])
+    """
+    centroids = np.array(clusterSums, dtype=np.float64)
+
+    # Dividing by cluster size, only for the non-empty clusters.
+    nonEmpty = clusterSize > 0
+    centroids[nonEmpty] /= clusterSize[nonEmpty, np.newaxis]
+
+    if not nonEmpty.all():
+        if previousCentroids is None:
+            centroids[~nonEmpty] = clusterSums.sum(axis=0) / clusterSize.sum()
+        else:
+            centroids[~nonEmpty] = np.asarray(previousCentroids)[~nonEmpty]
+
+    return centroids
+
+
+if NUMBA_AVAILABLE:
+
+    @njit(parallel=True, cache=True)
+    def KmeanRoundNumbaKernel(pointsT, centroids, assignment, nbBlocks):
+        """For each point, finds the nearest centroid, writes it in
+        <assignment> and adds the point to the sums of its cluster, in a
+        single pass over the points and without any distance matrix.
+
+        <pointsT> is a n*'number of dimensions' array (the transpose of the
+        usual layout), so that the coordinates of a point are contiguous.
+        The points are split in <nbBlocks> blocks, processed in parallel :
+        each block has its own cluster sums and sizes, reduced at the end.
+
+        Returns the k*'number of dimensions' cluster sums, the k sizes and
+        the sum of the squared distances of the points to their centroid.
+        """
+        nbPoints, nbDim = pointsT.shape
+        k = centroids.shape[0]
+        blockSize = (nbPoints + nbBlocks - 1) // nbBlocks
+
+        clusterSums = np.zeros((nbBlocks, k, nbDim))
+        clusterSize = np.zeros((nbBlocks, k), dtype=np.int64)
+        blockInertia = np.zeros(nbBlocks)
+
+        for b in prange(nbBlocks):
+            for i in range(b * blockSize, min((b + 1) * blockSize, nbPoints)):
+                point = pointsT[i]
+                closest = 0
+                closestDistance = np.inf
+                for c in range(k):
+                    d = 0.0
+                    for j in range(nbDim):
+                        diff = point[j] - centroids[c, j]
+                        d += diff * diff
+                    if d < closestDistance:
+                        closestDistance = d
+                        closest = c
+
+                assignment[i] = closest
+                blockInertia[b] += closestDistance
+                clusterSize[b, closest] += 1
+                for j in range(nbDim):
+                    clusterSums[b, closest, j] += point[j]
+
+        return clusterSums.sum(axis=0), clusterSize.sum(axis=0), blockInertia.sum()
+
+
+def KmeanRound(
+    points, centroids, backend="numpy", dtype=None, buffers=None, stats=None
+):
     """
     For each point, compute the nearest centroid.
     Then computes new centroids based on the assignment.
 
     * points: a 'number of dimensions'*n array.
-    * centroids: a list of 1*'number of dimensions' array.
+    * centroids: a k*'number of dimensions' array
+                 (or a list of 1*'number of dimensions' arrays).
+    * backend: "numpy", or "numba" to use a compiled kernel which assigns
+               and accumulates the points in one parallel pass.
+               Falls back to "numpy" if numba is not installed.
+    * dtype: floating point type of the distance computations (see
+             computeDtype). Centroids are always accumulated in float64.
+    * buffers: optional, the output of allocateRoundBuffers, reused to avoid
+               allocations. With the "numba" backend, buffers["pointsT"]
+               can hold a contiguous copy of points.T made once for all rounds.
+    * stats: optional dictionary, filled with the time spent assigning the
+             points ("assignmentTime") and computing the new centroids
+             ("centroidsTime"), and the inertia of the assignment (mean
+             squared distance of the points to their closest centroid).
+             With the "numpy" backend, buffers["pointNorms"] (see
+             computePointNorms) avoids recomputing the point norms.
 
     Returns :
-    * the new centroids : list of 'number of dimensions'*1 arrays.
+    * the new centroids : k*'number of dimensions' array.
     * new assignment : as a 1*n array containing indexes from 0 to k.
     """
+    if backend == "numba":
+        if NUMBA_AVAILABLE:
+            if buffers is None:
+                assignment = np.empty(points.shape[1], dtype=np.intp)
+                pointsT = np.ascontiguousarray(points.T)
+            else:
+                assignment = buffers["assignment"]
+                pointsT = buffers["pointsT"]
+            start = time.perf_counter()
+            clusterSums, clusterSize, inertia = KmeanRoundNumbaKernel(
+                pointsT,
+                np.asarray(centroids, dtype=np.float64),
+                assignment,
+                get_num_threads(),
+            )
+            middle = time.perf_counter()
+            newCentroids = computeCentroidsFromSums(
+                clusterSums, clusterSize, previousCentroids=centroids
+            )
+            if stats is not None:
+                stats["assignmentTime"] = middle - start
+                stats["centroidsTime"] = time.perf_counter() - middle
+                stats["inertia"] = inertia / len(assignment)
+            return newCentroids, assignment
+        warnings.warn("numba is not installed, using the numpy backend instead")
+    elif backend != "numpy":
+        raise ValueError("unknown backend: {}".format(backend))
 
-    assignment = computeNearestCentroid(points, centroids)
-    newCentroids = computeCentroids(points, assignment, len(centroids))
+    start = time.perf_counter()
+    if stats is None:
+        assignment = computeNearestCentroidBatched(
+            points, centroids, dtype=dtype, buffers=buffers
+        )
+    else:
+        assignment, distances = computeNearestCentroidBatched(
+            points,
+            centroids,
+            pointNorms=None if buffers is None else buffers.get("pointNorms"),
+            returnDistances=True,
+            dtype=dtype,
+            buffers=buffers,
+        )
+    middle = time.perf_counter()
+    newCentroids = computeCentroidsVectorized(
+        points,
+        assignment,
+        len(centroids),
+        previousCentroids=centroids,
+        buffer=None if buffers is None else buffers.get("pointsChunk"),
+    )
+    if stats is not None:
+        stats["assignmentTime"] = middle - start
+        stats["centroidsTime"] = time.perf_counter() - middle
+        stats["inertia"] = distances.mean()
     return newCentroids, assignment
 
 
-def Kmeans(pts, k, maxNbRounds=1000, assignment=None):
+def initKmeansPlusPlus(points, k, rng, weights=None):
+    """chooses <k> initial centroids among <points> with the k-means++
+    strategy: each new centroid is drawn with a probability proportional to
+    the squared distance of the point to the closest centroid already chosen.
+
+    * points: a 'number of dimensions'*n array
+    * rng: a np.random.Generator
+    * weights: optional 1D array of n weights of the points (see initKmeansParallel)
+
+    Centroids are returned as a k*'number of dimensions' array doctest strings:
+    >>> p = np.array([[ 0,  0, 10, 10],[ 0,  1, 0, 1]])
+    >>> c = initKmeansPlusPlus(p, 2, np.random.default_rng(0))
+    >>> sorted(c[:, 0].tolist())
+    [0.0, 10.0]
+    """
+    nbPoints = points.shape[1]
+    if weights is None:
+        weights = np.ones(nbPoints)
+
+    centroids = np.empty((k, points.shape[0]), dtype=np.float64)
+    centroids[0] = points[:, rng.choice(nbPoints, p=weights / weights.sum())]
+    closestDistances = computeDistanceToCentroid(points, centroids[0])[0]
+
+    for c in range(1, k):
+        probabilities = weights * closestDistances
+        if probabilities.sum() == 0:
+            # all points are already on a centroid -> uniform draw.
+            probabilities = weights
+        chosen = rng.choice(nbPoints, p=probabilities / probabilities.sum())
+        centroids[c] = points[:, chosen]
+        np.minimum(
+            closestDistances,
+            computeDistanceToCentroid(points, centroids[c])[0],
+            out=closestDistances,
+        )
+
+    return centroids
+
+
+def initKmeansParallel(points, k, rng, oversampling=None, nbRounds=5):
+    """chooses <k> initial centroids among <points> with the scalable
+    k-means|| strategy (Bahmani et al., 2012).
+
+    Instead of drawing the centroids one at a time, each of the <nbRounds>
+    rounds draws about <oversampling> (2*k by default) candidates at once,
+    each point with a probability proportional to its squared distance to
+    the closest candidate. The candidates are then weighted by the number of
+    points closest to them, and reduced to <k> centroids with a weighted
+    k-means++ on the candidates only.
+
+    Centroids are returned as a k*'number of dimensions' array doctest strings:
+    >>> p = np.array([[ 0,  0, 10, 10],[ 0,  1, 0, 1]])
+    >>> initKmeansParallel(p, 2, np.random.default_rng(0)).shape
+    (2, 2)
+    """
+    nbPoints = points.shape[1]
+    if oversampling is None:
+        oversampling = 2 * k
+
+    candidates = points[:, [rng.integers(nbPoints)]].T.astype(np.float64)
+    closestDistances = computeDistanceToCentroid(points, candidates[0])[0]
+
+    for r in range(nbRounds):
+        cost = closestDistances.sum()
+        if cost == 0:
+            break
+        probabilities = np.minimum(1, oversampling * closestDistances / cost)
+        chosen = points[:, rng.random(nbPoints) < probabilities].T
+        if len(chosen) == 0:
+            continue
+        _, newDistances = computeNearestCentroidBatched(
+            points, chosen, returnDistances=True
+        )
+        np.minimum(closestDistances, newDistances, out=closestDistances)
+        candidates = np.concatenate([candidates, chosen])
+
+    if len(candidates) <= k:
+        return initKmeansPlusPlus(points, k, rng)
+
+    weights = np.bincount(
+        computeNearestCentroidBatched(points, candidates), minlength=len(candidates)
+    )
+    return initKmeansPlusPlus(candidates.T, k, rng, weights=weights.astype(np.float64))
+
+
+def initializeAssignment(points, k, init="random", seed=None):
+    """computes an initial cluster assignment for <points>.
+
+    * init: "random" assigns each point to a random cluster.
+            "kmeans++" and "kmeans||" choose initial centroids (see
+            initKmeansPlusPlus and initKmeansParallel) and assign each point
+            to the closest one.
+    * seed: an int or a np.random.Generator, for reproducibility.
+
+    Returns a 1*n array containing indexes from 0 to k doctest strings:
+    >>> p = np.array([[ 0,  0, 10, 10],[ 0,  1, 0, 1]])
+    >>> initializeAssignment(p, 2, "kmeans++", seed=0).tolist() in ([0, 0, 1, 1], [1, 1, 0, 0])
+    True
+    """
+    rng = np.random.default_rng(seed)
+    if init == "random":
+        return rng.integers(0, k, points.shape[1])
+    elif init == "kmeans++":
+        centroids = initKmeansPlusPlus(points, k, rng)
+    elif init == "kmeans||":
+        centroids = initKmeansParallel(points, k, rng)
+    else:
+        raise ValueError("unknown init: {}".format(init))
+    return computeNearestCentroidBatched(points, centroids)
+
+
+def Kmeans(
+    pts,
+    k,
+    maxNbRounds=1000,
+    assignment=None,
+    algorithm="lloyd",
+    nbJobs=1,
+    backend="numpy",
+    init="random",
+    seed=None,
+    dtype=None,
+    tol=0.0,
+    callback=None,
+):
     """
     <pts> is a 'nb points' * 'nb of dimensions'
     <k> : number of clusters
     <maxNbRounds> : maximum number of Kmeans round to perform
+    <assignment> : optional initial assignment. If None, it is computed
+                   with the <init> strategy (see initializeAssignment).
+    <init> : "random", "kmeans++" or "kmeans||".
+    <seed> : an int or a np.random.Generator, for reproducibility.
+    <algorithm> : "lloyd" computes all point-centroid distances at each
+                  round, "elkan" skips most of them (see KmeansElkan).
+    <nbJobs> : number of processes used by the "lloyd" algorithm
+               (see KmeansParallel). The "elkan" algorithm raises a
+               ValueError if it is more than 1.
+    <backend> : "numpy" or "numba", used by each round of the single
+                process "lloyd" algorithm (see KmeanRound).
+    <dtype> : floating point type of the distance computations of the
+              single process "lloyd" algorithm with the "numpy" backend.
+              By default float32 for float32 points, float64 otherwise.
+              Centroids are always accumulated in float64.
+              The "numba" backend, the "elkan" and the parallel algorithms
+              only support the default <dtype> (and the last two only the
+              "numpy" <backend>) : a ValueError is raised otherwise.
+    The points can be a np.memmap (see loadPointsMemmap). The single
+    process algorithms with the "numpy" backend read it by chunks without
+    copying it, but the "numba" backend makes a transposed copy of it in
+    memory, and the parallel algorithm (nbJobs > 1) copies it once in
+    shared memory.
+    <tol> : also stop when all centroids moved by less than <tol> during a
+            round (see KmeansLloyd).
+    <callback> : optional function called after each round with a
+                 dictionary describing the round (see printRoundInfo).
+                 If it returns True, Kmeans stops.
 
     Returns a cluster assignment : as a 1*n array containing indexes
         from 0 to k
     """
     points = pts.T
-    nbPoints = points.shape[1]
+    rng = np.random.default_rng(seed)
 
     # 1. initialization
     if assignment is None:
-        # we use the random assignment here.
-        assignment = np.random.randint(0, k, nbPoints)
+        assignment = initializeAssignment(points, k, init, rng)
+
+    if algorithm not in ("lloyd", "elkan"):
+        raise ValueError("unknown algorithm: {}".format(algorithm))
+    if algorithm == "elkan" and nbJobs > 1:
+        raise ValueError('the "elkan" algorithm only runs in a single process')
+    if (algorithm == "elkan" or nbJobs > 1) and (
+        backend != "numpy" or dtype is not None
+    ):
+        raise ValueError(
+            "backend and dtype are only supported by the single process "
+            '"lloyd" algorithm'
+        )
+    if backend == "numba" and dtype is not None:
+        raise ValueError('dtype is not supported by the "numba" backend')
+
+    if algorithm == "elkan":
+        return KmeansElkan(points, k, maxNbRounds, assignment, tol, callback)[0]
+    elif nbJobs > 1:
+        return KmeansParallel(points, k, nbJobs, maxNbRounds, assignment, tol, callback)
+    return KmeansLloyd(
+        points, k, maxNbRounds, assignment, backend, rng, dtype, tol, callback
+    )
+
+
+def KmeansLloyd(
+    points,
+    k,
+    maxNbRounds,
+    assignment,
+    backend="numpy",
+    seed=None,
+    dtype=None,
+    tol=0.0,
+    callback=None,
+    returnNbRounds=False,
+):
+    """
+    Single process Kmeans (Lloyd's algorithm) from an initial <assignment>.
+
+    <points> is a 'number of dimensions'*n array
+    <k> : number of clusters
+    <maxNbRounds> : maximum number of Kmeans round to perform
+    <assignment> : initial assignment, as a 1*n array
+    <backend> : "numpy" or "numba" (see KmeanRound).
+    <seed> : an int or a np.random.Generator, used if the assignment has
+             to be redrawn.
+    <dtype> : floating point type of the distance computations
+              (see computeDtype).
+    <tol> : also stop when all centroids moved by less than <tol> during a
+            round. The default (0.0) only stops when no point changed
+            assignment.
+    <callback> : optional function called after each round with a
+                 dictionary describing the round (see printRoundInfo).
+                 If it returns True, Kmeans stops.
+    <returnNbRounds> : if True, also returns the number of rounds performed.
+                       Unlike counting them with a <callback>, this does not
+                       add the computation of the inertia to each round.
+
+    The arrays used by each round are allocated once, before the first
+    round : two assignment arrays are used alternately, one holding the
+    previous assignment while the other receives the new one.
 
-    centroids = computeCentroids(points, assignment, k)
+    Returns a cluster assignment : as a 1*n array containing indexes
+        from 0 to k
+    """
+    rng = np.random.default_rng(seed)
+    nbDim, nbPoints = points.shape
+    dtype = computeDtype(points, dtype)
+
+    chunkSize = computeChunkSize(nbDim, k, itemSize=dtype.itemsize)
+    buffers = allocateRoundBuffers(nbPoints, k, chunkSize, dtype, nbDim)
+    assignmentBuffers = [buffers["assignment"], np.empty(nbPoints, dtype=np.intp)]
+    changed = np.empty(nbPoints, dtype=bool)
+    if backend == "numba":
+        buffers["pointsT"] = np.ascontiguousarray(points.T)
+    if callback is None:
+        stats = None
+    else:
+        # the inertia is only computed when someone is listening.
+        stats = {}
+        buffers["pointNorms"] = computePointNorms(points)
+        buffers["minDistances"] = np.empty(nbPoints, dtype=np.float64)
+
+    centroids = computeCentroidsVectorized(
+        points, assignment, k, buffer=buffers["pointsChunk"]
+    )
     round = 1
+    nbRounds = 0
 
     while round < maxNbRounds:
-        centroids, newAssignment = KmeanRound(points, centroids)
+        nbRounds += 1
+        buffers["assignment"] = assignmentBuffers[round % 2]
+        previousCentroids = centroids
+        centroids, newAssignment = KmeanRound(
+            points, centroids, backend, dtype, buffers, stats
+        )
 
-        nbChanged = np.sum(newAssignment != assignment)
+        np.not_equal(newAssignment, assignment, out=changed)
+        nbChanged = np.count_nonzero(changed)
+        shift = np.sqrt(((centroids - previousCentroids) ** 2).sum(axis=1).max())
 
         assignment = newAssignment
 
+        if callback is not None:
+            info = dict(stats, round=round, nbChanged=nbChanged, shift=shift)
+            if callback(info):
+                break
+
         if nbChanged == 0:  # Nothing has changed -> we have converged !
             break
+        elif shift < tol:  # Centroids have (almost) stopped moving.
+            break
         elif nbChanged == nbPoints:
             # Something fishy occurs -> redraw random points to allow convergence
-            assignment = np.random.randint(0, k, nbPoints)
-            centroids = computeCentroids(points, assignment, k)
+            assignment = rng.integers(0, k, nbPoints)
+            centroids = computeCentroidsVectorized(
+                points, assignment, k, buffer=buffers["pointsChunk"]
+            )
 
-        # print("round {}, {:.2%} points changed assignment".format(round,nbChanged/nbPoints))
         round += 1
         # plotClusters( points , assignment , assignment , dimX=0 , dimY=1 )
         # plt.show()
 
+    if returnNbRounds:
+        return assignment, nbRounds
     return assignment
+
+
+def printRoundInfo(info):
+    """callback for Kmeans which prints the dictionary describing each round:
+    * "round": the round number.
+    * "assignmentTime", "centroidsTime": time (in seconds) spent assigning
+      the points and computing the new centroids.
+    * "nbChanged": number of points which changed assignment.
+    * "inertia": mean squared distance of the points to their closest centroid.
+    * "shift": largest distance moved by a centroid.
+
+    >>> printRoundInfo({"round": 3, "assignmentTime": 0.012, "centroidsTime": 0.003,
+    ...                 "nbChanged": 12, "inertia": 1.5, "shift": 0.25})
+    round 3: assignment 0.0120s, centroids 0.0030s, 12 changed, inertia 1.5, shift 0.25
+    """
+    print(
+        "round {round}: assignment {assignmentTime:.4f}s, "
+        "centroids {centroidsTime:.4f}s, {nbChanged} changed, "
+        "inertia {inertia:.4g}, shift {shift:.4g}".format(**info)
+    )
+
+
+def computeCentroidDistances(centroids):
+    """computes the euclidean distance between all pairs of <centroids>
+    * centroids: a k*'number of dimensions' array.
+
+    The distances are returned as a k*k array doctest strings:
+    >>> computeCentroidDistances(np.array([[0, 0], [3, 4], [0, 1]]))
+    array([[0.        , 5.        , 1.        ],
+           [5.        , 0.        , 4.24264069],
+           [1.        , 4.24264069, 0.        ]])
+    """
+    diff = centroids[:, np.newaxis, :] - centroids[np.newaxis, :, :]
+    return np.sqrt((diff**2).sum(axis=2))
+
+
+def computePairDistances(points, centroids, pointIndexes, centroidIndexes, chunkSize):
+    """computes the euclidean distance between the points and centroids of
+    each pair (pointIndexes[i], centroidIndexes[i]), <chunkSize> pairs at a
+    time so that memory stays bounded.
+
+    >>> p = np.array([[ 0,  0, 1, 1],[ 0,  1, 0, 1]])
+    >>> c = np.array([[0., 0.], [1., 1.]])
+    >>> computePairDistances(p, c, np.array([3, 1]), np.array([0, 1]), 1)
+    array([1.41421356, 1.        ])
+    """
+    distances = np.empty(len(pointIndexes), dtype=np.float64)
+    for start in range(0, len(pointIndexes), chunkSize):
+        stop = start + chunkSize
+        diff = (
+            points[:, pointIndexes[start:stop]]
+            - centroids[centroidIndexes[start:stop]].T
+        )
+        distances[start:stop] = np.sqrt((diff**2).sum(axis=0))
+    return distances
+
+
+def computeCandidateMask(upperBounds, lowerBounds, halfDistances, assignment):
+    """computes which (point, centroid) pairs may be closer than the current
+    centroid of the point, given the bounds.
+
+    * upperBounds: 1D array of n upper bounds of the distance of each point
+                   to its assigned centroid.
+    * lowerBounds: n*k array of lower bounds of the point-centroid distances.
+    * halfDistances: k*k array of half the distances between centroids.
+    * assignment: a 1*n array containing indexes from 0 to k.
+
+    A centroid c is ruled out for point x when u(x) <= l(x, c) or when
+    u(x) <= d(a(x), c) / 2. Returns a n*k boolean array doctest strings:
+    >>> u = np.array([1.0, 3.0])
+    >>> l = np.array([[1.0, 2.0], [0.0, 0.0]])
+    >>> h = np.array([[0.0, 2.5], [2.5, 0.0]])
+    >>> computeCandidateMask(u, l, h, np.array([0, 0]))
+    array([[False, False],
+           [False,  True]])
+    """
+    bound = upperBounds[:, np.newaxis]
+    mask = (bound > lowerBounds) & (bound > halfDistances[assignment])
+    mask[np.arange(len(assignment)), assignment] = False
+    return mask
+
+
+def KmeansElkan(points, k, maxNbRounds=1000, assignment=None, tol=0.0, callback=None):
+    """
+    Kmeans accelerated with the triangle inequality (Elkan, 2003).
+
+    For each point, an upper bound of the distance to its centroid and a
+    lower bound of the distance to every other centroid are kept from round
+    to round. A point-centroid distance is only computed when these bounds,
+    or the distances between centroids, cannot prove that this centroid is
+    farther than the current one. Late in the run, when few points change
+    assignment, most distances are skipped.
+
+    <points> is a 'number of dimensions'*n array
+    <k> : number of clusters
+    <maxNbRounds> : maximum number of Kmeans round to perform
+    <assignment> : optional initial assignment (random by default)
+    <tol>, <callback> : see KmeansLloyd. The rounds are the same as in
+                        KmeansLloyd : the first one, which computes all the
+                        distances, is reported as round 1. The inertia given
+                        to <callback> costs one distance per point and round.
+
+    Returns :
+    * a cluster assignment : as a 1*n array containing indexes from 0 to k
+    * the per-round counters : a list with, for each round, a dictionary
+      containing the number of point-centroid distances computed
+      ("nbComputed") and skipped ("nbSkipped"), and the number of points
+      which changed assignment ("nbChanged").
+    """
+    nbDim, nbPoints = points.shape
+    chunkSize = computeChunkSize(nbDim, 1)
+    pointIndexes = np.arange(nbPoints)
+    counters = []
+
+    # 1. initialization
+    if assignment is None:
+        # we use the random assignment here.
+        assignment = np.random.randint(0, k, nbPoints)
+
+    centroids = computeCentroidsVectorized(points, assignment, k)
+    lowerBounds = np.empty((nbPoints, k), dtype=np.float64)
+    round = 1
+
+    while round < maxNbRounds:
+        start = time.perf_counter()
+        if round == 1:
+            # first round : all distances are computed to initialize the
+            # bounds.
+            for c in range(k):
+                lowerBounds[:, c] = np.sqrt(
+                    computeDistanceToCentroid(points, centroids[c])
+                )
+            newAssignment = np.argmin(lowerBounds, axis=1)
+            upperBounds = lowerBounds[pointIndexes, newAssignment]
+            nbComputed = nbPoints * k
+            nbChanged = int(np.sum(newAssignment != assignment))
+            assignment = newAssignment
+        else:
+            # 2. points whose upper bound is below half the distance between
+            #    their centroid and the closest other centroid cannot change
+            #    assignment.
+            centroidDistances = computeCentroidDistances(centroids)
+            halfDistances = 0.5 * centroidDistances
+            np.fill_diagonal(centroidDistances, np.inf)
+            halfMinDistances = 0.5 * centroidDistances.min(axis=1)
+
+            active = np.flatnonzero(upperBounds > halfMinDistances[assignment])
+            activeAssignment = assignment[active]
+
+            # 3. tightening the upper bound of points which still have
+            #    candidates.
+            mask = computeCandidateMask(
+                upperBounds[active],
+                lowerBounds[active],
+                halfDistances,
+                activeAssignment,
+            )
+            toTighten = active[mask.any(axis=1)]
+            tight = computePairDistances(
+                points, centroids, toTighten, assignment[toTighten], chunkSize
+            )
+            upperBounds[toTighten] = tight
+            lowerBounds[toTighten, assignment[toTighten]] = tight
+
+            # 4. computing the remaining candidate distances.
+            mask = computeCandidateMask(
+                upperBounds[active],
+                lowerBounds[active],
+                halfDistances,
+                activeAssignment,
+            )
+            rows, cols = np.nonzero(mask)
+            lowerBounds[active[rows], cols] = computePairDistances(
+                points, centroids, active[rows], cols, chunkSize
+            )
+
+            distances = np.where(mask, lowerBounds[active], np.inf)
+            distances[np.arange(len(active)), activeAssignment] = upperBounds[active]
+            newActiveAssignment = np.argmin(distances, axis=1)
+            upperBounds[active] = distances[np.arange(len(active)), newActiveAssignment]
+
+            nbComputed = len(toTighten) + len(rows)
+            nbChanged = int(np.sum(newActiveAssignment != activeAssignment))
+            assignment[active] = newActiveAssignment
+
+        counters.append(
+            {
+                "nbComputed": nbComputed,
+                "nbSkipped": nbPoints * k - nbComputed,
+                "nbChanged": nbChanged,
+            }
+        )
+        if callback is not None:
+            # the upper bounds of inactive points are not exact distances.
+            distances = computePairDistances(
+                points, centroids, pointIndexes, assignment, chunkSize
+            )
+            inertia = np.mean(distances**2)
+        middle = time.perf_counter()
+
+        # 5. moving centroids, and loosening the bounds accordingly.
+        newCentroids = computeCentroidsVectorized(
+            points, assignment, k, previousCentroids=centroids
+        )
+        shift = np.sqrt(((newCentroids - centroids) ** 2).sum(axis=1))
+        centroids = newCentroids
+        upperBounds += shift[assignment]
+        lowerBounds -= shift
+        np.maximum(lowerBounds, 0, out=lowerBounds)
+
+        if callback is not None:
+            info = {
+                "round": round,
+                "assignmentTime": middle - start,
+                "centroidsTime": time.perf_counter() - middle,
+                "nbChanged": nbChanged,
+                "inertia": inertia,
+                "shift": shift.max(),
+            }
+            if callback(info):
+                break
+
+        if nbChanged == 0:  # Nothing has changed -> we have converged !
+            break
+        elif shift.max() < tol:  # Centroids have (almost) stopped moving.
+            break
+
+        round += 1
+
+    return assignment, counters
+
+
+def loadPointsMemmap(filename):
+    """opens a .npy file containing a 'number of dimensions'*n array as a
+    read-only memory-mapped array: points are only read from disk when a
+    batch of them is accessed, so the file can be larger than the RAM.
+    """
+    return np.load(filename, mmap_mode="r")
+
+
+def iterateBatches(points, batchSize, nbEpochs=1, shuffle=False, seed=None):
+    """yields successive batches of <batchSize> points of <points>.
+
+    * points: a 'number of dimensions'*n array, possibly a np.memmap
+              (see loadPointsMemmap).
+    * batchSize: number of points per batch.
+    * nbEpochs: number of passes over all the points.
+    * shuffle: if True, the order of the batches is shuffled at each epoch.
+               Each batch is still a contiguous block of points, so reads
+               from a memory-mapped file stay sequential.
+    * seed: seed of the random generator used when <shuffle> is True.
+
+    Batches are 'number of dimensions'*<batchSize> arrays (the last one of
+    each epoch may be smaller) doctest strings:
+    >>> p = np.arange(10).reshape(2, 5)
+    >>> [b.tolist() for b in iterateBatches(p, 2)]
+    [[[0, 1], [5, 6]], [[2, 3], [7, 8]], [[4], [9]]]
+    """
+    rng = np.random.default_rng(seed)
+    nbPoints = points.shape[1]
+
+    for epoch in range(nbEpochs):
+        starts = np.arange(0, nbPoints, batchSize)
+        if shuffle:
+            rng.shuffle(starts)
+        for start in starts:
+            yield np.asarray(points[:, start : start + batchSize])
+
+
+def computeInertia(points, centroids, pointNorms=None):
+    """computes the mean squared distance between each point of <points>
+    and its closest centroid.
+
+    >>> p = np.array([[ 0,  0, 1, 1],[ 0,  1, 0, 1]])
+    >>> c = [ np.array([ -0.5, 0.5]) , np.array([ 1.5, 0.5]) ]
+    >>> float(computeInertia(p, c))
+    0.5
+    """
+    _, distances = computeNearestCentroidBatched(
+        points, centroids, pointNorms=pointNorms, returnDistances=True
+    )
+    return distances.mean()
+
+
+def MiniBatchKmeans(
+    batches,
+    k,
+    validationPoints=None,
+    maxNoImprovement=10,
+    tol=0.0,
+    seed=None,
+    verbose=False,
+):
+    """
+    Mini-batch Kmeans: centroids are updated from one batch of points at a
+    time, so that memory is bounded by the batch size and the whole dataset
+    never has to be in memory.
+
+    <batches> : an iterable (e.g. a generator, or iterateBatches(...)) of
+                'number of dimensions'*b arrays.
+    <k> : number of clusters
+    <validationPoints> : 'number of dimensions'*m array of held-out points
+                         used to monitor convergence. If None, the first
+                         batch is held-out (and not used for training), so
+                         <batches> must have at least two batches.
+    <maxNoImprovement> : stop when the smoothed held-out inertia has not
+                         improved for this many consecutive batches.
+    <tol> : stop when all centroids moved by less than <tol> during a
+            batch, as in KmeansLloyd. The default (0.0) disables this
+            criterion.
+    <seed> : seed of the random generator used to pick the initial centroids.
+
+    Each centroid c has its own learning rate 1/n_c, where n_c is the number
+    of points assigned to it so far: a centroid is the running mean of all
+    the points it has received.
+
+    Returns :
+    * the centroids : k*'number of dimensions' array. Points can then be
+      assigned batch by batch with computeNearestCentroidBatched.
+    * the history : a list with, for each batch, a dictionary containing the
+      number of points seen so far ("nbPoints"), the held-out inertia
+      ("inertia") and the largest centroid displacement ("shift").
+    """
+    rng = np.random.default_rng(seed)
+    batches = iter(batches)
+
+    heldOut = validationPoints is None
+    if heldOut:
+        validationPoints = next(batches, None)
+    # 1. initialization : k distinct points drawn from the first batch.
+    batch = None if validationPoints is None else next(batches, None)
+    if batch is None:
+        if heldOut:
+            raise ValueError(
+                "without validationPoints, the first batch is held-out : "
+                "a held-out batch and at least one training batch are required"
+            )
+        raise ValueError("at least one training batch is required")
+    validationNorms = computePointNorms(validationPoints)
+
+    if batch.shape[1] < k:
+        raise ValueError(
+            "the first batch has {} points, less than k={}".format(batch.shape[1], k)
+        )
+    centroids = np.array(
+        batch[:, rng.choice(batch.shape[1], k, replace=False)].T, dtype=np.float64
+    )
+    clusterSize = np.zeros(k, dtype=np.int64)
+
+    history = []
+    nbPoints = 0
+    bestInertia = np.inf
+    smoothedInertia = None
+    nbNoImprovement = 0
+
+    while batch is not None:
+        # 2. assignment, then per-cluster running mean update.
+        assignment = computeNearestCentroidBatched(batch, centroids)
+        batchSums, batchSize = computeClusterSums(batch, assignment, k)
+
+        clusterSize += batchSize
+        updated = batchSize > 0
+        previousCentroids = centroids.copy()
+        centroids[updated] += (
+            batchSums[updated] - batchSize[updated, np.newaxis] * centroids[updated]
+        ) / clusterSize[updated, np.newaxis]
+
+        nbPoints += batch.shape[1]
+        shift = np.sqrt(((centroids - previousCentroids) ** 2).sum(axis=1).max())
+
+        # 3. monitoring convergence on the held-out points.
+        inertia = computeInertia(validationPoints, centroids, validationNorms)
+        history.append({"nbPoints": nbPoints, "inertia": inertia, "shift": shift})
+        if verbose:
+            print(
+                "batch {}, {} points seen, held-out inertia {:.4g}, shift {:.4g}".format(
+                    len(history), nbPoints, inertia, shift
+                )
+            )
+
+        # exponentially weighted average, to smooth the noise of single batches.
+        if smoothedInertia is None:
+            smoothedInertia = inertia
+        else:
+            smoothedInertia = 0.7 * smoothedInertia + 0.3 * inertia
+
+        if smoothedInertia < bestInertia:
+            bestInertia = smoothedInertia
+            nbNoImprovement = 0
+        else:
+            nbNoImprovement += 1
+
+        if nbNoImprovement >= maxNoImprovement or shift < tol:
+            break
+
+        batch = next(batches, None)
+
+    return centroids, history
+
+
+# Points and assignment of the current KmeansParallel run, as seen by each
+# worker process. They are set once per process by initParallelWorker.
+WORKER_SHARED = {}
+
+
+def attachSharedArray(name, shape, dtype):
+    """returns a numpy array backed by the existing shared memory block <name>,
+    and the SharedMemory object which must be kept alive while it is used.
+    """
+    try:
+        # python >= 3.13: workers must not unlink the block when they exit.
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+def createSharedArray(array):
+    """copies <array> in a new shared memory block.
+
+    Returns the shared copy and the SharedMemory object : the caller is
+    responsible for calling close() and unlink() on it.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[:] = array
+    return shared, shm
+
+
+def initParallelWorker(pointsSpec, assignmentSpec):
+    """Pool initializer: maps the shared points and assignment in the worker.
+
+    Each spec is a (name, shape, dtype) tuple describing a shared array.
+    """
+    WORKER_SHARED["points"], WORKER_SHARED["pointsShm"] = attachSharedArray(*pointsSpec)
+    WORKER_SHARED["assignment"], WORKER_SHARED["assignmentShm"] = attachSharedArray(
+        *assignmentSpec
+    )
+
+
+def parallelRoundTask(args):
+    """computes the assignment of the points in columns start:stop of the
+    shared points, writes it in the shared assignment, and returns the
+    partial cluster sums and sizes of this slice, the number of points
+    which changed assignment and, if <withInertia>, the sum of the squared
+    distances of the points to their centroid (0 otherwise).
+    """
+    start, stop, centroids, withInertia = args
+    points = WORKER_SHARED["points"][:, start:stop]
+    assignment = WORKER_SHARED["assignment"]
+
+    inertia = 0.0
+    if withInertia:
+        newAssignment, distances = computeNearestCentroidBatched(
+            points, centroids, returnDistances=True
+        )
+        inertia = float(distances.sum())
+    else:
+        newAssignment = computeNearestCentroidBatched(points, centroids)
+    nbChanged = int(np.sum(newAssignment != assignment[start:stop]))
+    assignment[start:stop] = newAssignment
+
+    clusterSums, clusterSize = computeClusterSums(points, newAssignment, len(centroids))
+    return clusterSums, clusterSize, nbChanged, inertia
+
+
+def KmeansParallel(
+    points, k, nbJobs, maxNbRounds=1000, assignment=None, tol=0.0, callback=None
+):
+    """
+    Kmeans where each round is split between <nbJobs> processes.
+
+    The points are copied once in shared memory, so they are not pickled
+    at each round: only the centroids are sent to the workers. Each worker
+    computes the assignment of its slice of points (written directly in a
+    shared assignment array) and the partial sums of each cluster, which
+    are then reduced in the parent process to get the new centroids.
+
+    <points> is a 'number of dimensions'*n array
+    <k> : number of clusters
+    <nbJobs> : number of worker processes
+    <maxNbRounds> : maximum number of Kmeans round to perform
+    <assignment> : optional initial assignment (random by default)
+    <tol>, <callback> : see KmeansLloyd. The inertia given to <callback>
+                        is computed by the workers.
+
+    Returns a cluster assignment : as a 1*n array containing indexes
+        from 0 to k
+    """
+    nbPoints = points.shape[1]
+
+    # 1. initialization
+    if assignment is None:
+        # we use the random assignment here.
+        assignment = np.random.randint(0, k, nbPoints)
+
+    centroids = computeCentroidsVectorized(points, assignment, k)
+
+    bounds = np.linspace(0, nbPoints, nbJobs + 1).astype(int)
+    slices = list(zip(bounds[:-1], bounds[1:]))
+
+    sharedPoints, pointsShm = createSharedArray(np.ascontiguousarray(points))
+    sharedAssignment, assignmentShm = createSharedArray(
+        np.asarray(assignment, dtype=np.intp)
+    )
+    pointsSpec = (pointsShm.name, sharedPoints.shape, sharedPoints.dtype)
+    assignmentSpec = (
+        assignmentShm.name,
+        sharedAssignment.shape,
+        sharedAssignment.dtype,
+    )
+
+    try:
+        with mp.Pool(
+            nbJobs,
+            initializer=initParallelWorker,
+            initargs=(pointsSpec, assignmentSpec),
+        ) as pool:
+            round = 1
+            while round < maxNbRounds:
+                start = time.perf_counter()
+                withInertia = callback is not None
+                results = pool.map(
+                    parallelRoundTask,
+                    [(a, b, centroids, withInertia) for a, b in slices],
+                )
+                middle = time.perf_counter()
+
+                # 2. reduction of the partial sums in the parent.
+                clusterSums = sum(r[0] for r in results)
+                clusterSize = sum(r[1] for r in results)
+                nbChanged = sum(r[2] for r in results)
+                previousCentroids = centroids
+                centroids = computeCentroidsFromSums(
+                    clusterSums, clusterSize, centroids
+                )
+                shift = np.sqrt(
+                    ((centroids - previousCentroids) ** 2).sum(axis=1).max()
+                )
+
+                if callback is not None:
+                    info = {
+                        "round": round,
+                        "assignmentTime": middle - start,
+                        "centroidsTime": time.perf_counter() - middle,
+                        "nbChanged": nbChanged,
+                        "inertia": sum(r[3] for r in results) / nbPoints,
+                        "shift": shift,
+                    }
+                    if callback(info):
+                        break
+
+                if nbChanged == 0:  # Nothing has changed -> we have converged !
+                    break
+                elif shift < tol:  # Centroids have (almost) stopped moving.
+                    break
+                round += 1
+
+        assignment = sharedAssignment.copy()
+    finally:
+        del sharedPoints, sharedAssignment
+        for shm in (pointsShm, assignmentShm):
+            shm.close()
+            shm.unlink()
+
+    return assignment
+
+
+def benchmarkParallelKmeans(points, k, nbJobsList=(1, 2, 4, 8), maxNbRounds=1000):
+    """times KmeansParallel for each number of processes in <nbJobsList>,
+    starting from the same random assignment, and prints the speedup
+    relative to the serial Kmeans.
+
+    Returns a dictionary {number of processes: time in seconds}.
+    """
+    initialAssignment = np.random.randint(0, k, points.shape[1])
+
+    start = time.perf_counter()
+    reference = KmeansLloyd(points, k, maxNbRounds, initialAssignment.copy())
+    serialTime = time.perf_counter() - start
+    print("serial      : {:.3f}s".format(serialTime))
+
+    times = {}
+    for nbJobs in nbJobsList:
+        start = time.perf_counter()
+        result = KmeansParallel(
+            points, k, nbJobs, maxNbRounds, initialAssignment.copy()
+        )
+        times[nbJobs] = time.perf_counter() - start
+        print(
+            "{} processes : {:.3f}s (speedup {:.2f}){}".format(
+                nbJobs,
+                times[nbJobs],
+                serialTime / times[nbJobs],
+                "" if np.array_equal(result, reference) else " - different result!",
+            )
+        )
+    return times
+
+
+def splitWorstCluster(points, centroids, assignment, distances):
+    """warm-start helper for KmeansSweep: splits the centroid of the cluster
+    with the largest sum of squared distances into two centroids, moved by
+    half a standard deviation (per dimension) of the cluster on each side.
+
+    * points: a 'number of dimensions'*n array
+    * centroids: a k*'number of dimensions' array
+    * assignment: a 1*n array containing indexes from 0 to k
+    * distances: a 1D array of the squared distance of each point to its centroid
+
+    Returns a (k+1)*'number of dimensions' array doctest strings:
+    >>> p = np.array([[ 0,  0, 10, 12],[ 0,  0, 0, 0]])
+    >>> c = np.array([[0., 0.], [11., 0.]])
+    >>> splitWorstCluster(p, c, np.array([0, 0, 1, 1]), np.array([0., 0., 1., 1.]))
+    array([[ 0. ,  0. ],
+           [10.5,  0. ],
+           [11.5,  0. ]])
+    """
+    k = len(centroids)
+    worst = np.argmax(np.bincount(assignment, weights=distances, minlength=k))
+
+    members = points[:, assignment == worst]
+    delta = 0.5 * members.std(axis=1)
+
+    newCentroids = np.concatenate([centroids, centroids[[worst]]])
+    newCentroids[worst] -= delta
+    newCentroids[k] += delta
+    return newCentroids
+
+
+def initSweepWorker(pointsSpec):
+    """Pool initializer: maps the shared points in the worker."""
+    WORKER_SHARED["points"], WORKER_SHARED["pointsShm"] = attachSharedArray(*pointsSpec)
+
+
+def sweepTask(args):
+    """runs Kmeans with k-means++ initialization on the shared points and
+    returns the assignment and the inertia.
+    """
+    k, maxNbRounds, seed = args
+    points = WORKER_SHARED["points"]
+    rng = np.random.default_rng(seed)
+    assignment = initializeAssignment(points, k, "kmeans++", rng)
+    assignment = KmeansLloyd(points, k, maxNbRounds, assignment, seed=rng)
+    centroids = computeCentroidsVectorized(points, assignment, k)
+    return assignment, float(computeInertia(points, centroids))
+
+
+def KmeansSweep(pts, kValues=range(1, 11), maxNbRounds=1000, nbJobs=1, seed=None):
+    """
+    Performs Kmeans for several numbers of clusters in one call, for
+    instance to draw an elbow plot or to switch quickly between values of k.
+
+    <pts> is a 'nb points' * 'nb of dimensions'
+    <kValues> : the numbers of clusters to try
+    <maxNbRounds> : maximum number of Kmeans round to perform, for each k
+    <nbJobs> : if 1, the values of k are processed in increasing order and
+               each one is warm-started from the centroids of the previous
+               one, by splitting its worst cluster (see splitWorstCluster).
+               Otherwise, the values of k are processed independently (with
+               k-means++ initialization) by <nbJobs> processes sharing the
+               points in shared memory.
+    <seed> : an int or a np.random.Generator, for reproducibility.
+
+    Returns :
+    * a dictionary {k: cluster assignment as a 1*n array}
+    * a dictionary {k: inertia (mean squared distance of the points to their
+      centroid, see computeInertia)}
+    """
+    points = pts.T
+    rng = np.random.default_rng(seed)
+    kValues = sorted(kValues)
+    assignments = {}
+    inertias = {}
+
+    if nbJobs > 1:
+        sharedPoints, pointsShm = createSharedArray(np.ascontiguousarray(points))
+        pointsSpec = (pointsShm.name, sharedPoints.shape, sharedPoints.dtype)
+        seeds = rng.integers(0, 2**32, len(kValues))
+        try:
+            with mp.Pool(
+                nbJobs, initializer=initSweepWorker, initargs=(pointsSpec,)
+            ) as pool:
+                results = pool.map(
+                    sweepTask, [(k, maxNbRounds, s) for k, s in zip(kValues, seeds)]
+                )
+        finally:
+            del sharedPoints
+            pointsShm.close()
+            pointsShm.unlink()
+
+        for k, (assignment, inertia) in zip(kValues, results):
+            assignments[k] = assignment
+            inertias[k] = inertia
+        return assignments, inertias
+
+    # the point norms are shared by all values of k.
+    pointNorms = computePointNorms(points)
+    assignment = initializeAssignment(points, kValues[0], "kmeans++", rng)
+    centroids = None
+
+    for k in kValues:
+        if centroids is not None:
+            # warm start : splitting clusters until there are k centroids.
+            while len(centroids) < k:
+                centroids = splitWorstCluster(points, centroids, assignment, distances)
+                assignment, distances = computeNearestCentroidBatched(
+                    points, centroids, pointNorms, returnDistances=True
+                )
+
+        assignment = KmeansLloyd(points, k, maxNbRounds, assignment, seed=rng)
+        centroids = computeCentroidsVectorized(points, assignment, k)
+        assignment, distances = computeNearestCentroidBatched(
+            points, centroids, pointNorms, returnDistances=True
+        )
+
+        assignments[k] = assignment
+        inertias[k] = float(distances.mean())
+
+    return assignments, inertias
+
+
+def benchmarkSeeding(
+    points, k, inits=("random", "kmeans++", "kmeans||"), nbRepeats=5, seed=0
+):
+    """compares the initialization strategies of Kmeans : for each of them,
+    prints the average number of rounds and wall time (initialization
+    included) needed to converge, over <nbRepeats> runs.
+
+    <points> is a 'number of dimensions'*n array. The rounds are counted by
+    KmeansLloyd itself (see returnNbRounds), so that the timings do not
+    include any per-round instrumentation.
+
+    For example, on the digits dataset of course3:
+        df = pd.read_csv("data/digits.PCA20.csv", index_col=0)
+        points = df.loc[:, [f"PC{i}" for i in range(20)]].to_numpy().T
+        benchmarkSeeding(points, 10)
+
+    Returns a dictionary {init: (average number of rounds, average time)}.
+    """
+    rng = np.random.default_rng(seed)
+    results = {}
+
+    for init in inits:
+        nbRounds = []
+        times = []
+        for repeat in range(nbRepeats):
+            start = time.perf_counter()
+            assignment = initializeAssignment(points, k, init, rng)
+            _, rounds = KmeansLloyd(
+                points, k, 1000, assignment, seed=rng, returnNbRounds=True
+            )
+            times.append(time.perf_counter() - start)
+            nbRounds.append(rounds)
+
+        results[init] = (np.mean(nbRounds), np.mean(times))
+        print(
+            "{:<9}: {:6.1f} rounds, {:.4f}s".format(init, *results[init]),
+        )
+
+    return results
@@ -29,7 +29,7 @@ df_umap = pd.read_csv( "data/digits.UMAP.csv" ,  index_col=0 )
 data = df_pca.loc[ : , [f"PC{i}" for i in range(20)] ].to_numpy()
 # helper functions 
 
-from kmeans import Kmeans
+from kmeans import KmeansSweep
 
 import plotly.graph_objects as go
 import numpy as np
@@ -60,8 +60,9 @@ import dash_bootstrap_components as dbc
 
 
 # setup some default
-CURRENT_K = 1 ## remember the current K.
-CLUSTER_ASSIGNMENT = Kmeans(data , k = CURRENT_K)
+## the clusterings for all K of the dropdown are computed once, at startup.
+CLUSTER_ASSIGNMENTS , INERTIAS = KmeansSweep(data , kValues = range(1,11))
+CLUSTER_ASSIGNMENT = CLUSTER_ASSIGNMENTS[1]
 
 
 
@@ -89,13 +90,10 @@ row = html.Div([
     Input('K-selection', 'value'), 
 )
 def update_fig(DR , K):
-    ## access these variables as global in order to update them
+    ## access this variable as global in order to update it
     global CLUSTER_ASSIGNMENT
-    global CURRENT_K
 
-    if K != CURRENT_K:
-        CLUSTER_ASSIGNMENT = Kmeans( data , k=K)
-        CURRENT_K = K
+    CLUSTER_ASSIGNMENT = CLUSTER_ASSIGNMENTS[K]
     
     df = df_pca
     if DR == "UMAP":
@@ -1,10 +1,13 @@
 from dash import Dash, html, dcc, callback, Output, Input
 import dash_bootstrap_components as dbc
 
+from kmeans import KmeansSweep
+
 
 # setup some default
-CURRENT_K = 1 ## remember the current K.
-CLUSTER_ASSIGNMENT = Kmeans(data , k = CURRENT_K)
+## the clusterings for all K of the dropdown are computed once, at startup.
+CLUSTER_ASSIGNMENTS , INERTIAS = KmeansSweep(data , kValues = range(1,11))
+CLUSTER_ASSIGNMENT = CLUSTER_ASSIGNMENTS[1]
 
 
 
@@ -38,13 +41,10 @@ row = html.Div([
     Input('K-selection', 'value'), 
 )
 def update_DR(DR , K):
-    ## access these variables as global in order to update them
+    ## access this variable as global in order to update it
     global CLUSTER_ASSIGNMENT
-    global CURRENT_K
 
-    if K != CURRENT_K:
-        CLUSTER_ASSIGNMENT = Kmeans( data , k=K)
-        CURRENT_K = K
+    CLUSTER_ASSIGNMENT = CLUSTER_ASSIGNMENTS[K]
     
     df = df_pca
     if DR == "UMAP":